@@ -4,8 +4,7 @@ import sys
 
 sys.path.append('/opt/py')
 
-import bottle
-
+import api.server
 import api.util
 import api.v1
 import api.v2
@@ -19,4 +18,4 @@ application.merge(api.v1.application)
 application.mount('/v2/', api.v2.application)
 
 if __name__ == '__main__':
-    bottle.run(app=application, host='0.0.0.0', port=8081)
+    api.server.run(application)
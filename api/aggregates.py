@@ -0,0 +1,164 @@
+import collections
+import contextlib
+import itertools
+import json
+import sqlite3
+
+import api.log
+import api.region
+import api.util
+import api.util2
+
+CHECKPOINT_LINES = 10000 # log lines processed per transaction
+SCHEMA_VERSION = 2
+
+def store_path():
+    return api.util.CONFIG['cache'] / 'aggregates.sqlite'
+
+def connect():
+    """Opens the store of log-derived aggregates, creating or upgrading it if necessary. If the cache directory doesn't exist, an empty in-memory database is used instead, so the aggregates are computed from scratch without being stored."""
+    if api.util.CONFIG['cache'].exists():
+        path = str(store_path())
+    else:
+        path = ':memory:'
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None) # transactions are managed by the transaction function
+    connection.execute('PRAGMA journal_mode=WAL')
+    if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+        with transaction(connection):
+            if connection.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION: # another process migrated while we waited for the lock
+                return connection
+            for table in ('checkpoints', 'deaths', 'last_seen', 'last_achievements', 'regions'):
+                connection.execute('DROP TABLE IF EXISTS {}'.format(table))
+            connection.execute('CREATE TABLE checkpoints (world TEXT, aggregate TEXT, version TEXT, cursor TEXT, player_uuids TEXT, PRIMARY KEY (world, aggregate))')
+            connection.execute('CREATE TABLE deaths (world TEXT, player TEXT, timestamp TEXT, cause TEXT)')
+            connection.execute('CREATE TABLE last_seen (world TEXT, player TEXT, timestamp TEXT, PRIMARY KEY (world, player))')
+            connection.execute('CREATE TABLE last_achievements (world TEXT, player TEXT, timestamp TEXT, PRIMARY KEY (world, player))')
+            connection.execute('CREATE TABLE regions (world TEXT, dimension TEXT, region TEXT, mtime REAL, columns TEXT, PRIMARY KEY (world, dimension, region))')
+            connection.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+    return connection
+
+@contextlib.contextmanager
+def transaction(connection):
+    """Runs the with block in a write transaction, which other processes using the store wait for. Rolls back if the block raises."""
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+    except:
+        connection.execute('ROLLBACK')
+        raise
+    else:
+        connection.execute('COMMIT')
+
+def player_key(player):
+    """Returns the form in which a player is stored in the aggregate tables: the Minecraft UUID if known, so rows stay valid when the people database changes. See player_id."""
+    return str(player) if player.uuid is None else str(player.uuid)
+
+def player_id(key):
+    """Returns the player ID used in API results for a player stored as the given key, see player_key."""
+    return api.util2.player_id_by_uuid(key)
+
+def update_from_log(connection, world, aggregate, version, handle_line, tables):
+    """Brings a log-derived aggregate up to date by passing each log line since its checkpoint to handle_line(connection, line).
+
+    Required arguments:
+    connection -- A connection returned by connect.
+    world -- A minecraft.World.
+    aggregate -- The name under which the checkpoint is stored.
+    version -- A JSON-serializable value. If it differs from the version of the checkpoint, the world's rows in the given tables are deleted and the logs are read from the start.
+    handle_line -- Called with the connection and each api.log.Line. It should only write the world's rows in the given tables, storing players with player_key.
+
+    The logs are read in a single pass outside of any transaction. After every CHECKPOINT_LINES lines, handle_line is called for them in a short write transaction, which also moves the checkpoint to the end of the last line, so an interrupted update resumes where it left off. If another process has moved the checkpoint in the meantime, the update starts over from there, so each line is handled once. Lines are only repeated if the log file of the checkpoint has been deleted.
+    """
+    version = json.dumps(version, sort_keys=True)
+    while True:
+        row = connection.execute('SELECT version, cursor, player_uuids FROM checkpoints WHERE world = ? AND aggregate = ?', (world.name, aggregate)).fetchone()
+        if row is None or row[0] != version:
+            reset = True
+            cursor = None
+            player_uuids = {}
+        else:
+            reset = False
+            cursor = row[1]
+            player_uuids = {nick: api.util2.player_by_id(player) for nick, player in json.loads(row[2]).items()}
+        checkpoint = None if row is None else tuple(row[:2])
+        lines = api.log.Log(world).positioned(cursor, player_uuids=player_uuids)
+        while True:
+            batch = []
+            for line, _, cursor in itertools.islice(lines, CHECKPOINT_LINES):
+                batch.append(line)
+            if len(batch) == 0 and not reset:
+                return # the checkpoint is up to date
+            with transaction(connection):
+                row = connection.execute('SELECT version, cursor FROM checkpoints WHERE world = ? AND aggregate = ?', (world.name, aggregate)).fetchone()
+                if (None if row is None else tuple(row)) != checkpoint:
+                    break # another process has moved the checkpoint since we read it
+                if reset:
+                    for table in tables:
+                        connection.execute('DELETE FROM {} WHERE world = ?'.format(table), (world.name,))
+                    reset = False
+                for line in batch:
+                    handle_line(connection, line)
+                connection.execute('INSERT OR REPLACE INTO checkpoints (world, aggregate, version, cursor, player_uuids) VALUES (?, ?, ?, ?, ?)', (world.name, aggregate, version, cursor, json.dumps({nick: player_key(player) for nick, player in player_uuids.items()}, sort_keys=True)))
+            checkpoint = version, cursor
+            if len(batch) < CHECKPOINT_LINES:
+                return
+
+def deaths(world):
+    """Returns a dict mapping player IDs to lists of their deaths in the world, in chronological order. Each death is a dict with the keys "cause" and "timestamp"."""
+    def handle_line(connection, line):
+        if line.type is api.log.LineType.death:
+            connection.execute('INSERT INTO deaths (world, player, timestamp, cause) VALUES (?, ?, ?, ?)', (world.name, player_key(line.data['player']), line.data['time'].strftime('%Y-%m-%d %H:%M:%S'), line.data['cause']))
+
+    result = collections.defaultdict(list)
+    with contextlib.closing(connect()) as connection:
+        update_from_log(connection, world, 'deaths', len(api.log.death_messages), handle_line, ['deaths'])
+        for player, timestamp, cause in connection.execute('SELECT player, timestamp, cause FROM deaths WHERE world = ? ORDER BY rowid', (world.name,)):
+            result[player_id(player)].append({
+                'cause': cause,
+                'timestamp': timestamp
+            })
+    return result
+
+def last_seen(world):
+    """Returns a dict mapping player IDs to the UTC time of their last join or leave line in the world's logs, formatted as %Y-%m-%d %H:%M:%S."""
+    def handle_line(connection, line):
+        if line.type is api.log.LineType.join or line.type is api.log.LineType.leave:
+            connection.execute('INSERT OR REPLACE INTO last_seen (world, player, timestamp) VALUES (?, ?, ?)', (world.name, player_key(line.data['player']), line.data['time'].strftime('%Y-%m-%d %H:%M:%S')))
+
+    with contextlib.closing(connect()) as connection:
+        update_from_log(connection, world, 'last_seen', 1, handle_line, ['last_seen'])
+        return {player_id(player): timestamp for player, timestamp in connection.execute('SELECT player, timestamp FROM last_seen WHERE world = ?', (world.name,))}
+
+def last_achievements(world):
+    """Returns a dict mapping player IDs to the UTC time of the last achievement they earned according to the world's logs, formatted as %Y-%m-%d %H:%M:%S."""
+    def handle_line(connection, line):
+        if line.type is api.log.LineType.achievement:
+            connection.execute('INSERT OR REPLACE INTO last_achievements (world, player, timestamp) VALUES (?, ?, ?)', (world.name, player_key(line.data['player']), line.data['time'].strftime('%Y-%m-%d %H:%M:%S')))
+
+    with contextlib.closing(connect()) as connection:
+        update_from_log(connection, world, 'last_achievements', 1, handle_line, ['last_achievements'])
+        return {player_id(player): timestamp for player, timestamp in connection.execute('SELECT player, timestamp FROM last_achievements WHERE world = ?', (world.name,))}
+
+def chunk_columns(world):
+    """Returns a dict mapping the names of the world's dimensions to lists of the chunk columns that have been generated in them.
+
+    Only the location tables of region files which are new or were modified since the last call are read, and only their rows are written.
+    """
+    result = {}
+    with contextlib.closing(connect()) as connection:
+        for dimension in api.util2.Dimension:
+            if not dimension.region_path(world).exists():
+                with transaction(connection):
+                    connection.execute('DELETE FROM regions WHERE world = ? AND dimension = ?', (world.name, dimension.name))
+                continue
+            stored_mtimes = dict(connection.execute('SELECT region, mtime FROM regions WHERE world = ? AND dimension = ?', (world.name, dimension.name)))
+            region_mtimes = {region_path: region_path.stat().st_mtime for region_path in dimension.region_path(world).iterdir() if api.region.region_coords(region_path) is not None}
+            changed_regions = [region_path for region_path, mtime in region_mtimes.items() if region_path.stem not in stored_mtimes or mtime > stored_mtimes[region_path.stem]]
+            changed_columns = api.region.map_regions(api.region.chunk_columns, changed_regions) # read outside of the transaction so other processes don't have to wait for it
+            with transaction(connection):
+                for region_path, columns in changed_columns.items():
+                    connection.execute('INSERT OR REPLACE INTO regions (world, dimension, region, mtime, columns) VALUES (?, ?, ?, ?, ?)', (world.name, dimension.name, region_path.stem, region_mtimes[region_path], json.dumps(columns)))
+                for region_name in set(stored_mtimes) - {region_path.stem for region_path in region_mtimes}:
+                    connection.execute('DELETE FROM regions WHERE world = ? AND dimension = ? AND region = ?', (world.name, dimension.name, region_name))
+                result[dimension.name] = [column for columns, in connection.execute('SELECT columns FROM regions WHERE world = ? AND dimension = ? ORDER BY region', (world.name, dimension.name)) for column in json.loads(columns)]
+    return result
@@ -1,6 +1,9 @@
+import base64
 import datetime
 import enum
 import gzip
+import hashlib
+import json
 import minecraft
 import pathlib
 import re
@@ -99,6 +102,42 @@ class Line:
         result.update({key: value_as_json(value) for key, value in self.data.items()})
         return result
 
+CURSOR_HEAD_SIZE = 1024 # bytes at the start of a log file that identify it in cursors
+
+def encode_cursor(path, offset, time=None, head=None):
+    """Returns an opaque cursor string for the given byte offset into a log file, with path relative to the world directory. The time of the last line before the position is used as a fallback, see Log.positioned. The head is a digest of the start of the file (see head_digest), used to find the position again after latest.log has been archived."""
+    data = [str(path), offset, None if time is None else time.strftime('%Y-%m-%d %H:%M:%S'), head]
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Returns the (path, offset, time, head) tuple encoded in a cursor. The head is None for cursors from older versions of the API. Raises ValueError if the cursor is invalid."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+        if len(data) == 3:
+            data.append(None)
+        path, offset, time, head = data
+        path = pathlib.PurePosixPath(path)
+        if path.is_absolute() or '..' in path.parts or not isinstance(offset, int) or offset < 0 or not (head is None or isinstance(head, str)):
+            raise ValueError('Invalid position')
+        if time is not None:
+            time = datetime.datetime.strptime(time, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+        return pathlib.Path(str(path)), offset, time, head
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor: {!r}'.format(cursor)) from e
+
+def head_digest(head, offset):
+    """Returns a digest of the part of head (the first CURSOR_HEAD_SIZE bytes of a log file, or all of it if it's shorter) that lies before offset."""
+    return hashlib.sha1(head[:offset]).hexdigest()[:16]
+
+def parse_time(value):
+    """Parses a UTC time in the format used in JSON output (%Y-%m-%d %H:%M:%S), or a date (%Y-%m-%d) meaning its midnight. Raises ValueError on other formats."""
+    for time_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, time_format).replace(tzinfo=datetime.timezone.utc)
+        except ValueError:
+            continue
+    raise ValueError('Invalid time: {!r}'.format(value))
+
 class Log:
     def __init__(self, world=None, *, files=None, reversed=False):
         if world is None:
@@ -140,104 +179,209 @@ class Log:
             files.append(log_path)
         return self.__class__(self.world, files=files, reversed=self.is_reversed)
 
-    def __iter__(self):
-        def iter_file(log_file, player_uuids=None):
-            if player_uuids is None:
-                player_uuids = {}
-            for raw_line in self.raw_lines(log_file, yield_reversed=False):
-                try:
-                    if raw_line == '':
-                        continue
-                    prefixes = [
-                        ('full', Regexes.full_prefix),
-                        ('old', Regexes.old_prefix)
-                    ]
-                    for prefix_type, prefix_string in prefixes:
-                        match_prefix = '({}) {} (.*)'.format(Regexes.timestamp, prefix_string)
-                        base_match = re.fullmatch(match_prefix, raw_line)
-                        if not base_match:
-                            continue
-                        if prefix_type == 'full':
-                            # has a well-formatted timestamp, origin thread and log level
-                            timestamp, origin_thread, log_level, text = base_match.group(1, 2, 3, 4)
-                            time = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
-                        elif prefix_type == 'old':
-                            # has a well-formatted timestamp and log level, but no origin thread
-                            timestamp, log_level, text = base_match.group(1, 2, 3)
-                            origin_thread = None
-                            time = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
-                        break
-                    else:
-                        yield Line(LineType.gibberish, path=log_file, text=raw_line)
+    def _parse(self, log_file, raw_lines, player_uuids=None):
+        if player_uuids is None:
+            player_uuids = {}
+        for raw_line in raw_lines:
+            try:
+                if raw_line == '':
+                    continue
+                prefixes = [
+                    ('full', Regexes.full_prefix),
+                    ('old', Regexes.old_prefix)
+                ]
+                for prefix_type, prefix_string in prefixes:
+                    match_prefix = '({}) {} (.*)'.format(Regexes.timestamp, prefix_string)
+                    base_match = re.fullmatch(match_prefix, raw_line)
+                    if not base_match:
                         continue
-                    if origin_thread == 'Server thread' or origin_thread is None:
-                        if log_level == 'INFO':
-                            matches = {
-                                'achievement': '(' + Regexes.minecraft_nick + ') has just earned the achievement \\[(.+)\\]',
-                                'chat_action': '\\* (' + Regexes.minecraft_nick + ') (.*)',
-                                'chat_message': '<(' + Regexes.minecraft_nick + ')> (.*)',
-                                'join_leave': '(' + Regexes.minecraft_nick + ') (joined|left) the game',
-                                'start': 'Starting minecraft server version (.*)',
-                                'stop': 'Stopping the server'
-                            }
-                            for match_type, match_string in matches.items():
-                                match = re.fullmatch(match_string, text)
-                                if not match:
-                                    continue # not the type of message currently being tested for
-                                if match_type in ('achievement', 'chat_action', 'chat_message', 'join_leave'):
-                                    if match.group(1) == 'Server':
-                                        player = None
-                                    elif match.group(1) in player_uuids:
-                                        player = player_uuids[match.group(1)]
-                                    else:
-                                        player = player_uuids[match.group(1)] = api.util2.Player.by_minecraft_nick(match.group(1), at=time)
-                                if match_type == 'achievement':
-                                    yield Line(LineType.achievement, time=time, player=player, achievement=match.group(2))
-                                elif match_type == 'chat_action':
-                                    yield Line(LineType.chat_action, time=time, player=player, message=match.group(2))
-                                elif match_type == 'chat_message':
-                                    yield Line(LineType.chat_message, time=time, player=player, message=match.group(2))
-                                elif match_type == 'join_leave':
-                                    yield Line(LineType.join if match.group(2) == 'joined' else LineType.leave, time=time, player=player)
-                                elif match_type == 'start':
-                                    yield Line(LineType.start, time=time, version=match.group(1))
-                                elif match_type == 'stop':
-                                    yield Line(LineType.stop, time=time)
-                                break
-                            else:
-                                for death_regex in death_messages:
-                                    match = re.fullmatch('(' + Regexes.minecraft_nick + ') (' + death_regex + ')', text)
-                                    if match:
-                                        if match.group(1) in player_uuids:
-                                            player = player_uuids[match.group(1)]
-                                        else:
-                                            player = player_uuids[match.group(1)] = api.util2.Player.by_minecraft_nick(match.group(1), at=time)
-                                        yield Line(LineType.death, time=time, player=player, cause=match.group(2))
-                                        break
+                    if prefix_type == 'full':
+                        # has a well-formatted timestamp, origin thread and log level
+                        timestamp, origin_thread, log_level, text = base_match.group(1, 2, 3, 4)
+                        time = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+                    elif prefix_type == 'old':
+                        # has a well-formatted timestamp and log level, but no origin thread
+                        timestamp, log_level, text = base_match.group(1, 2, 3)
+                        origin_thread = None
+                        time = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+                    break
+                else:
+                    yield Line(LineType.gibberish, path=log_file, text=raw_line)
+                    continue
+                if origin_thread == 'Server thread' or origin_thread is None:
+                    if log_level == 'INFO':
+                        matches = {
+                            'achievement': '(' + Regexes.minecraft_nick + ') has just earned the achievement \\[(.+)\\]',
+                            'chat_action': '\\* (' + Regexes.minecraft_nick + ') (.*)',
+                            'chat_message': '<(' + Regexes.minecraft_nick + ')> (.*)',
+                            'join_leave': '(' + Regexes.minecraft_nick + ') (joined|left) the game',
+                            'start': 'Starting minecraft server version (.*)',
+                            'stop': 'Stopping the server'
+                        }
+                        for match_type, match_string in matches.items():
+                            match = re.fullmatch(match_string, text)
+                            if not match:
+                                continue # not the type of message currently being tested for
+                            if match_type in ('achievement', 'chat_action', 'chat_message', 'join_leave'):
+                                if match.group(1) == 'Server':
+                                    player = None
+                                elif match.group(1) in player_uuids:
+                                    player = player_uuids[match.group(1)]
                                 else:
-                                    yield Line(LineType.unknown, time=time, origin_thread=origin_thread, log_level=log_level, text=text)
+                                    player = player_uuids[match.group(1)] = api.util2.player_by_minecraft_nick(match.group(1), at=time)
+                            if match_type == 'achievement':
+                                yield Line(LineType.achievement, time=time, player=player, achievement=match.group(2))
+                            elif match_type == 'chat_action':
+                                yield Line(LineType.chat_action, time=time, player=player, message=match.group(2))
+                            elif match_type == 'chat_message':
+                                yield Line(LineType.chat_message, time=time, player=player, message=match.group(2))
+                            elif match_type == 'join_leave':
+                                yield Line(LineType.join if match.group(2) == 'joined' else LineType.leave, time=time, player=player)
+                            elif match_type == 'start':
+                                yield Line(LineType.start, time=time, version=match.group(1))
+                            elif match_type == 'stop':
+                                yield Line(LineType.stop, time=time)
+                            break
                         else:
-                            yield Line(LineType.unknown, time=time, origin_thread=origin_thread, log_level=log_level, text=text)
-                    elif origin_thread.startswith('User Authenticator'):
-                        if log_level == 'INFO':
-                            match = re.fullmatch('UUID of player ({}) is ({})'.format(Regexes.minecraft_nick, Regexes.uuid), text)
-                            if match:
-                                player_uuids[match.group(1)] = api.util2.Player(match.group(2))
+                            for death_regex in death_messages:
+                                match = re.fullmatch('(' + Regexes.minecraft_nick + ') (' + death_regex + ')', text)
+                                if match:
+                                    if match.group(1) in player_uuids:
+                                        player = player_uuids[match.group(1)]
+                                    else:
+                                        player = player_uuids[match.group(1)] = api.util2.player_by_minecraft_nick(match.group(1), at=time)
+                                    yield Line(LineType.death, time=time, player=player, cause=match.group(2))
+                                    break
                             else:
                                 yield Line(LineType.unknown, time=time, origin_thread=origin_thread, log_level=log_level, text=text)
+                    else:
+                        yield Line(LineType.unknown, time=time, origin_thread=origin_thread, log_level=log_level, text=text)
+                elif origin_thread.startswith('User Authenticator'):
+                    if log_level == 'INFO':
+                        match = re.fullmatch('UUID of player ({}) is ({})'.format(Regexes.minecraft_nick, Regexes.uuid), text)
+                        if match:
+                            player_uuids[match.group(1)] = api.util2.Player(match.group(2))
                         else:
                             yield Line(LineType.unknown, time=time, origin_thread=origin_thread, log_level=log_level, text=text)
                     else:
                         yield Line(LineType.unknown, time=time, origin_thread=origin_thread, log_level=log_level, text=text)
-                except Exception as e:
-                    raise ValueError('Failed to parse line {!r}'.format(raw_line)) from e
+                else:
+                    yield Line(LineType.unknown, time=time, origin_thread=origin_thread, log_level=log_level, text=text)
+            except Exception as e:
+                raise ValueError('Failed to parse line {!r}'.format(raw_line)) from e
 
+    def __iter__(self):
         for log_file in self.files:
             if self.is_reversed:
-                yield from reversed(list(iter_file(log_file)))
+                yield from reversed(list(self._parse(log_file, self.raw_lines(log_file, yield_reversed=False))))
             else:
                 player_uuids = {}
-                yield from iter_file(log_file, player_uuids=player_uuids)
+                yield from self._parse(log_file, self.raw_lines(log_file, yield_reversed=False), player_uuids=player_uuids)
+
+    def positioned(self, cursor=None, *, player_uuids=None):
+        """Yields (line, start, end) triples in chronological order, where start and end are cursors: opaque strings for the positions before and after the line.
+
+        Optional arguments:
+        cursor -- A cursor returned by an earlier call. If given, reading resumes exactly at that position, without re-reading the files before it. This includes positions in latest.log after it has been archived. If the position no longer exists, reading resumes at the first line logged at or after the cursor's time instead, so lines may be repeated but not skipped.
+        player_uuids -- A dict mapping Minecraft nicks to api.util2.Player objects, as known at the cursor's position. It is updated while reading, so it can be saved along with a cursor to resume in the middle of a file without looking up the nicks of players who joined before the cursor. It is cleared at the start of each file. If it's not given when resuming, such nicks are resolved with api.util2.player_by_minecraft_nick, which usually doesn't need the Mojang API.
+
+        An incomplete last line of a file that is still being written is not yielded until it is complete.
+        """
+        if self.is_reversed:
+            raise ValueError('Positioned iteration is only supported in chronological order')
+        if player_uuids is None:
+            player_uuids = {}
+        files = list(self.files)
+        offset = 0
+        min_time = None
+        if cursor is not None:
+            path, offset, time, head = decode_cursor(cursor)
+            resume_file = self._cursor_file(files, self.world.path / path, offset, time, head)
+            if resume_file is None:
+                offset = 0
+                min_time = time
+                if time is not None:
+                    files = self[time.date() - datetime.timedelta(days=2):].files # plus 2 more days to account for timezone weirdness
+            else:
+                files = files[files.index(resume_file):]
+        last_time = min_time
+        for log_file in files:
+            relative_path = log_file.relative_to(self.world.path)
+            position = [offset, offset] # before and after the current raw line
+            head = [b''] # start of the file, read when first needed
+
+            def raw_lines(start):
+                for end, raw_line in self._raw_lines_at(log_file, start):
+                    position[:] = position[1], end
+                    yield raw_line
+
+            def digest(offset):
+                if len(head[0]) < min(offset, CURSOR_HEAD_SIZE):
+                    head[0] = self._head(log_file)
+                return head_digest(head[0], offset)
+
+            if offset == 0:
+                player_uuids.clear()
+            for line in self._parse(log_file, raw_lines(offset), player_uuids=player_uuids):
+                time = line.data.get('time')
+                if min_time is not None:
+                    if time is None or time < min_time:
+                        continue
+                    min_time = None
+                if time is not None:
+                    last_time = time
+                yield line, encode_cursor(relative_path, position[0], last_time, digest(position[0])), encode_cursor(relative_path, position[1], last_time, digest(position[1]))
+            offset = 0
+
+    def _cursor_file(self, files, path, offset, time, head):
+        # returns the file among files which contains the position of a cursor, or None if it can't be found
+        if head is None and path.name == 'latest.log':
+            return None # cursor from an older version of the API, which can't tell whether latest.log has been replaced since, so fall back to its time
+        candidates = [path]
+        if path.name == 'latest.log':
+            archived = files if time is None else self[time.date() - datetime.timedelta(days=2):].files
+            candidates += [log_path for log_path in archived if log_path != path] # latest.log may have been archived since the cursor was created
+        for candidate in candidates:
+            if candidate not in files:
+                continue
+            if candidate.suffix != '.gz' and offset > candidate.stat().st_size:
+                continue
+            if head is not None and head_digest(self._head(candidate), offset) != head:
+                continue
+            return candidate
+        return None
+
+    def since_last_start(self, date):
+        """Returns a Log of the files logged on or after the given date, preceded by the earlier files back to the last one containing a server start, so that the server uptime which was ongoing on that date is complete. Only the earlier files are read, until a server start is found."""
+        files = self[date:].files
+        for log_path in reversed([log_path for log_path in self.files if log_path not in files]):
+            files.insert(0, log_path)
+            if any(re.search(' Starting minecraft server version ', raw_line) for raw_line in self.raw_lines(log_path, yield_reversed=False)):
+                break
+        return self.__class__(self.world, files=files, reversed=self.is_reversed)
+
+    def _head(self, log_path):
+        # returns the first CURSOR_HEAD_SIZE bytes of the uncompressed file
+        if log_path.suffix == '.gz':
+            log = gzip.open(str(log_path))
+        else:
+            log = log_path.open('rb')
+        with log:
+            return log.read(CURSOR_HEAD_SIZE)
+
+    def _raw_lines_at(self, log_path, offset):
+        # yields (offset after the line, line) pairs, with offsets into the uncompressed file
+        if log_path.suffix == '.gz':
+            log = gzip.open(str(log_path))
+        else:
+            log = log_path.open('rb')
+        with log:
+            log.seek(offset)
+            for line in log:
+                if not line.endswith(b'\n') and log_path.suffix != '.gz':
+                    break # still being written
+                offset += len(line)
+                yield offset, line.decode('utf-8').rstrip('\r\n')
 
     def reversed(self):
         return self.__class__(self.world, files=reversed(self.files), reversed=not self.is_reversed)
@@ -0,0 +1,87 @@
+import multiprocessing
+import os
+import pathlib
+import re
+import struct
+import threading
+
+SECTOR_SIZE = 4096
+REGION_WIDTH = 32 # chunk columns per region along each axis
+
+def region_coords(region_path):
+    """Returns the (x, z) coordinates of a region file from its name, or None if the path is not named like a region file."""
+    match = re.fullmatch('r\\.(-?[0-9]+)\\.(-?[0-9]+)\\.mca', pathlib.Path(region_path).name)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+
+def read_header(region_path):
+    """Reads the location and timestamp tables of a region file.
+
+    Returns a tuple of two lists with 1024 ints each, indexed by x + 32 * z where x and z are the column coordinates modulo 32. A location of 0 means that the chunk column has not been generated. Region files that are too short to contain a header are treated as empty.
+    """
+    with open(str(region_path), 'rb') as region_file:
+        header = region_file.read(2 * SECTOR_SIZE)
+    if len(header) < 2 * SECTOR_SIZE:
+        return [0] * REGION_WIDTH ** 2, [0] * REGION_WIDTH ** 2
+    return list(struct.unpack('>1024I', header[:SECTOR_SIZE])), list(struct.unpack('>1024I', header[SECTOR_SIZE:]))
+
+def chunk_columns(region_path):
+    """Returns a list of {'x': ..., 'z': ...} dicts, one for each chunk column present in the region file, using only its location table."""
+    region_x, region_z = region_coords(region_path)
+    locations, _ = read_header(region_path)
+    result = []
+    for i, location in enumerate(locations):
+        if location != 0:
+            z, x = divmod(i, REGION_WIDTH)
+            result.append({
+                'x': REGION_WIDTH * region_x + x,
+                'z': REGION_WIDTH * region_z + z
+            })
+    return result
+
+def chunk_timestamps(region_path):
+    """Returns a dict mapping (x, z) coordinate pairs of all chunk columns present in the region file to their last modification time, as recorded in the region header."""
+    region_x, region_z = region_coords(region_path)
+    locations, timestamps = read_header(region_path)
+    result = {}
+    for i, (location, timestamp) in enumerate(zip(locations, timestamps)):
+        if location != 0:
+            z, x = divmod(i, REGION_WIDTH)
+            result[REGION_WIDTH * region_x + x, REGION_WIDTH * region_z + z] = timestamp
+    return result
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_pid = None
+
+def _worker_pool():
+    # the pool is created on first use, and again in forked children, which can't use their parent's pool
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = multiprocessing.get_context('spawn').Pool(processes=os.cpu_count() or 1) # forking from a request thread could copy locks held by other threads into the workers
+            _pool_pid = os.getpid()
+        return _pool
+
+def shutdown_pool():
+    """Stops the worker processes of map_regions and the threads managing them, e.g. before forking. The next call to map_regions starts a new pool."""
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+            _pool.join()
+        _pool = None
+        _pool_pid = None
+
+def map_regions(func, region_paths):
+    """Calls func on each of the region paths and returns a dict mapping the paths to the results.
+
+    If there is more than one path, the calls are distributed over a pool of worker processes, which is shared by all threads and started with the spawn method, so it's safe to use from request threads. func must be a module-level function so it can be sent to the workers.
+    """
+    region_paths = list(region_paths)
+    if len(region_paths) <= 1:
+        return {region_path: func(region_path) for region_path in region_paths}
+    pool = _worker_pool()
+    return dict(zip(region_paths, pool.map(func, region_paths, chunksize=max(1, len(region_paths) // (4 * (os.cpu_count() or 1))))))
@@ -0,0 +1,431 @@
+import concurrent.futures
+import contextlib
+import http.server
+import io
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+
+import api.region
+import api.status
+import api.tile_entities
+import api.util
+import api.util2
+
+from api.version import __version__
+
+ACCEPT_QUEUE_FACTOR = 2 # connections accepted per thread, including those being handled, before the server stops accepting
+
+SERVER_DEFAULTS = {
+    'host': '0.0.0.0',
+    'keepAliveTimeout': 5, # seconds an idle keep-alive connection is kept open
+    'mode': 'threaded', # 'threaded' for one process with a thread pool, 'prefork' for several such processes, or 'wsgiref' for bottle's single-threaded development server
+    'port': 8081,
+    'threads': 16, # per process
+    'timeout': 60, # seconds of socket inactivity before a request is aborted, also the time given to running requests on shutdown
+    'warmUp': [], # paths requested before the server starts accepting connections, e.g. to fill caches before forking workers
+    'workers': 0 # processes for prefork mode, 0 for the number of CPUs
+}
+
+def server_config():
+    """Returns the server section of the API configuration, with defaults filled in."""
+    result = dict(SERVER_DEFAULTS)
+    result.update(api.util.CONFIG.get('server', {}))
+    return result
+
+class _BodyReader(io.RawIOBase):
+    # wsgi.input that stops at the end of the request body, so the next request on a keep-alive connection can be read
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        size = min(len(buf), self.remaining)
+        if size == 0:
+            return 0
+        data = self.rfile.read(size)
+        buf[:len(data)] = data
+        self.remaining -= len(data)
+        if len(data) == 0:
+            self.remaining = 0
+        return len(data)
+
+    def drain(self):
+        while self.remaining > 0 and len(self.read(min(self.remaining, 65536))) > 0:
+            pass
+
+class WSGIRequestHandler(http.server.BaseHTTPRequestHandler):
+    """An HTTP/1.1 request handler for a WSGI application that keeps connections alive, using chunked transfer encoding for responses of unknown length."""
+    protocol_version = 'HTTP/1.1'
+    server_version = 'WurstminebergAPI/{}'.format(__version__)
+
+    def setup(self):
+        self.timeout = self.server.config['timeout']
+        self.requests_handled = 0
+        super().setup()
+
+    def handle_one_request(self):
+        self.connection.settimeout(self.server.config['keepAliveTimeout'] if self.requests_handled > 0 else self.server.config['timeout'])
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = self.request_version = self.command = ''
+            self.send_error(414)
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        self.connection.settimeout(self.server.config['timeout'])
+        if not self.parse_request():
+            return
+        if self.server.stopping.is_set():
+            self.close_connection = True
+        self.run_wsgi()
+        self.requests_handled += 1
+
+    def run_wsgi(self):
+        path, _, query_string = self.path.partition('?')
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self.send_error(400, 'Invalid Content-Length')
+            return
+        body = _BodyReader(self.rfile, content_length)
+        environ = dict(self.server.base_environ)
+        environ.update({
+            'PATH_INFO': urllib.parse.unquote(path, 'iso-8859-1'),
+            'QUERY_STRING': query_string,
+            'REMOTE_ADDR': self.client_address[0],
+            'REQUEST_METHOD': self.command,
+            'SERVER_PROTOCOL': self.request_version,
+            'wsgi.input': io.BufferedReader(body),
+            'wsgi.errors': sys.stderr
+        })
+        if 'Content-Type' in self.headers:
+            environ['CONTENT_TYPE'] = self.headers['Content-Type']
+        if 'Content-Length' in self.headers:
+            environ['CONTENT_LENGTH'] = self.headers['Content-Length']
+        for name, value in self.headers.items():
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            if key in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+                continue
+            environ[key] = '{},{}'.format(environ[key], value) if key in environ else value
+        response = {'status': None, 'headers': None, 'headers_sent': False, 'chunked': False}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None:
+                try:
+                    if response['headers_sent']:
+                        raise exc_info[1].with_traceback(exc_info[2])
+                finally:
+                    exc_info = None
+            elif response['status'] is not None:
+                raise AssertionError('start_response called twice')
+            response['status'] = status
+            response['headers'] = headers
+            return write
+
+        def send_headers():
+            code, _, reason = response['status'].partition(' ')
+            code = int(code)
+            self.send_response(code, reason)
+            header_names = set()
+            for name, value in response['headers']:
+                header_names.add(name.lower())
+                self.send_header(name, value)
+            if 'content-length' not in header_names and self.command != 'HEAD' and code >= 200 and code not in (204, 304):
+                if self.request_version == 'HTTP/1.1':
+                    response['chunked'] = True
+                    self.send_header('Transfer-Encoding', 'chunked')
+                else:
+                    self.close_connection = True # the end of the body is marked by closing the connection
+            if self.close_connection:
+                self.send_header('Connection', 'close')
+            self.end_headers()
+            response['headers_sent'] = True
+
+        def write(data):
+            if not response['headers_sent']:
+                send_headers()
+            if len(data) == 0 or self.command == 'HEAD':
+                return
+            if response['chunked']:
+                self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+            else:
+                self.wfile.write(data)
+
+        try:
+            result = self.server.app(environ, start_response)
+            try:
+                for data in result:
+                    write(data)
+                if not response['headers_sent']:
+                    send_headers()
+                if response['chunked']:
+                    self.wfile.write(b'0\r\n\r\n')
+                self.wfile.flush()
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            body.drain()
+        except (ConnectionError, socket.timeout):
+            self.close_connection = True
+        except Exception:
+            traceback.print_exc()
+            self.close_connection = True
+            if not response['headers_sent']:
+                self.send_error(500)
+
+    def log_message(self, format, *args):
+        sys.stderr.write('{} - - [{}] {}\n'.format(self.address_string(), self.log_date_time_string(), format % args))
+
+class ThreadPoolHTTPServer(http.server.HTTPServer):
+    """An HTTP server for a WSGI application that handles connections in a fixed-size pool of threads.
+
+    If sock is given, it is used as the listening socket instead of binding a new one, e.g. a socket inherited from the master process in prefork mode.
+    """
+    def __init__(self, app, config, *, sock=None, multiprocess=False):
+        self.app = app
+        self.config = config
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=config['threads'])
+        self.futures = set() # connections being handled or waiting for a thread
+        self.futures_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(ACCEPT_QUEUE_FACTOR * config['threads'])
+        self.stopping = threading.Event()
+        super().__init__((config['host'], config['port']), WSGIRequestHandler, bind_and_activate=sock is None)
+        if sock is not None:
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
+        host, port = self.server_address[:2]
+        self.base_environ = {
+            'GATEWAY_INTERFACE': 'CGI/1.1',
+            'SCRIPT_NAME': '',
+            'SERVER_NAME': socket.getfqdn(host),
+            'SERVER_PORT': str(port),
+            'SERVER_SOFTWARE': WSGIRequestHandler.server_version,
+            'wsgi.multiprocess': multiprocess,
+            'wsgi.multithread': True,
+            'wsgi.run_once': False,
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0)
+        }
+
+    def process_request(self, request, client_address):
+        # blocks accepting while too many connections are waiting, so further clients wait in the listen backlog of the kernel instead of an unbounded queue
+        while not self.slots.acquire(timeout=0.5):
+            if self.stopping.is_set():
+                self.shutdown_request(request)
+                return
+        future = self.executor.submit(self._process_request, request, client_address)
+        with self.futures_lock:
+            self.futures.add(future)
+        future.add_done_callback(self._request_done)
+
+    def _request_done(self, future):
+        with self.futures_lock:
+            self.futures.discard(future)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def serve_until_stopped(self, stop_event):
+        """Serves requests until stop_event is set, then waits up to the configured timeout for running requests to finish. Returns whether they all finished."""
+        thread = threading.Thread(target=self.serve_forever, name='HTTP server')
+        thread.start()
+        while not stop_event.wait(1):
+            pass
+        self.stopping.set() # keep-alive connections are closed after their current request
+        self.shutdown()
+        thread.join()
+        with self.futures_lock:
+            futures = set(self.futures)
+        _, not_done = concurrent.futures.wait(futures, timeout=self.config['timeout'] + self.config['keepAliveTimeout'])
+        self.executor.shutdown(wait=False)
+        return len(not_done) == 0
+
+def listen(config):
+    """Returns a listening socket for the host and port in the server config."""
+    family = socket.AF_INET6 if ':' in config['host'] else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((config['host'], config['port']))
+    sock.listen(socket.SOMAXCONN)
+    return sock
+
+def warm_up(app, paths):
+    """Requests each of the paths from the app in-process and discards the responses, so that caches are filled before serving."""
+    for path in paths:
+        path, _, query_string = path.partition('?')
+        environ = {
+            'PATH_INFO': path,
+            'QUERY_STRING': query_string,
+            'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': '',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '0',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.errors': sys.stderr,
+            'wsgi.input': io.BytesIO(),
+            'wsgi.url_scheme': 'http'
+        }
+        status = []
+        try:
+            for _ in app(environ, lambda status_line, headers, exc_info=None: status.append(status_line)):
+                pass
+        except Exception:
+            traceback.print_exc()
+        else:
+            print('Warm-up {}: {}'.format(path, status[0] if status else 'no response'), file=sys.stderr)
+
+def _start_background_work():
+    # starts the background threads when the server starts rather than on the first request, if this process does background work
+    api.util2.start_precomputer()
+    api.tile_entities.start_indexer()
+
+def _stop_on_signals(stop_event, signums=(signal.SIGINT, signal.SIGTERM)):
+    for signum in signums:
+        signal.signal(signum, lambda signum, frame: stop_event.set())
+
+def serve_threaded(app, config, *, sock=None, multiprocess=False):
+    """Serves the app from a thread pool in this process until SIGINT or SIGTERM, then finishes running requests. If they don't finish within the configured timeout, the process exits anyway."""
+    stop_event = threading.Event()
+    _stop_on_signals(stop_event)
+    server = ThreadPoolHTTPServer(app, config, sock=sock, multiprocess=multiprocess)
+    if not server.serve_until_stopped(stop_event):
+        print('Requests still running after {} seconds, exiting anyway'.format(config['timeout'] + config['keepAliveTimeout']), file=sys.stderr)
+        sys.stderr.flush()
+        sys.stdout.flush()
+        os._exit(1) # the interpreter would wait for the pool threads at exit
+
+def _reexec(sock, worker_pids):
+    # replaces the master process with a fresh interpreter that loads the current code, passing on the listening socket and the workers to retire
+    os.set_inheritable(sock.fileno(), True)
+    env = dict(os.environ, API_LISTEN_FD=str(sock.fileno()), API_OLD_WORKERS=','.join(str(pid) for pid in worker_pids))
+    main_spec = getattr(sys.modules['__main__'], '__spec__', None)
+    if main_spec is None:
+        argv = [sys.executable] + sys.argv
+    else:
+        module_name = main_spec.name[:-len('.__main__')] if main_spec.name.endswith('.__main__') else main_spec.name
+        argv = [sys.executable, '-m', module_name] + sys.argv[1:]
+    os.execve(sys.executable, argv, env)
+
+def serve_prefork(app, config, sock):
+    """Forks worker processes which each serve the app from a thread pool on the shared listening socket, restarting workers that exit.
+
+    The master handles these signals:
+    SIGINT, SIGTERM -- Stop the workers after they finish their running requests, then exit.
+    SIGHUP -- Graceful reload: re-execute the master with the same socket, so that code and config changes take effect. The new master warms up and starts new workers before the old ones are stopped.
+
+    Background work which maintains state shared by all processes (see api.util2.set_background_work) is only done by the worker in the first slot, including its replacements.
+    """
+    num_workers = config['workers'] or os.cpu_count() or 1
+    stop_event = threading.Event()
+    reload_event = threading.Event()
+    _stop_on_signals(stop_event)
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_event.set())
+    workers = {} # pid: slot
+    old_workers = {int(pid) for pid in os.environ.pop('API_OLD_WORKERS', '').split(',') if pid}
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+                    signal.signal(signum, signal.SIG_DFL)
+                api.util2.set_background_work(slot == 0)
+                _start_background_work()
+                serve_threaded(app, config, sock=sock, multiprocess=True)
+            except BaseException:
+                traceback.print_exc()
+                os._exit(1)
+            os._exit(0)
+        workers[pid] = slot
+
+    while True:
+        if stop_event.is_set():
+            break
+        if reload_event.is_set():
+            _reexec(sock, set(workers) | old_workers)
+        for slot in sorted(set(range(num_workers)) - set(workers.values())):
+            spawn(slot)
+        # the new workers are up, retire the workers of the previous master
+        for pid in old_workers:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+        old_workers = set()
+        # reap exited workers, including the previous master's
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in workers:
+                del workers[pid]
+                time.sleep(1) # don't restart crashing workers in a tight loop
+        stop_event.wait(0.5)
+    for pid in workers:
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGTERM)
+    deadline = time.monotonic() + config['timeout'] + config['keepAliveTimeout']
+    while len(workers) > 0 and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.1)
+        else:
+            workers.pop(pid, None)
+    for pid in workers:
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGKILL)
+
+def run(app, config=None):
+    """Runs the API server as configured in the server section of the API config."""
+    if config is None:
+        config = server_config()
+    if config['mode'] == 'wsgiref':
+        import bottle
+
+        bottle.run(app=app, host=config['host'], port=config['port'])
+        return
+    if 'API_LISTEN_FD' in os.environ: # re-executed by a graceful reload
+        fd = int(os.environ.pop('API_LISTEN_FD'))
+        sock = socket.fromfd(fd, socket.AF_INET6 if ':' in config['host'] else socket.AF_INET, socket.SOCK_STREAM)
+        os.close(fd)
+    else:
+        sock = listen(config)
+    if config['mode'] == 'prefork':
+        api.util2.set_background_work(False) # started in one of the workers instead
+    warm_up(app, config['warmUp'])
+    if config['mode'] == 'prefork':
+        # so no threads are running while forking, which could hold locks the workers then inherit
+        api.status.stop_poller()
+        api.region.shutdown_pool()
+    if config['mode'] == 'threaded':
+        _start_background_work()
+        serve_threaded(app, config, sock=sock)
+    elif config['mode'] == 'prefork':
+        serve_prefork(app, config, sock)
+    else:
+        raise ValueError('Unknown server mode: {!r}'.format(config['mode']))
@@ -0,0 +1,144 @@
+import concurrent.futures
+import datetime
+import minecraft
+import threading
+import time
+import traceback
+
+import api.util
+import api.util2
+
+POLL_INTERVAL = 5 # seconds between status probes of each world
+PROBE_TIMEOUT = 3 # seconds a request waits for the first probe of a world
+PROBE_WORKERS = 8
+
+_executor = None
+_pending = {} # world name: future of the running probe
+_poller = None
+_poller_lock = threading.Lock()
+_poller_stop = None # event that stops the running poller
+_snapshot = {} # world name: (monotonic start time of the probe, status)
+_snapshot_lock = threading.Lock()
+
+def probe(world):
+    """Returns the status of the world in the format of /world/<world>/status.json, with the UTC time of the probe in the "updated" field.
+
+    The list of online players is only included if mcstatus is installed. If the server doesn't respond to the ping, the list is empty.
+    """
+    result = api.util2.short_world_status(world)
+    try:
+        import mcstatus
+    except ImportError:
+        pass
+    else:
+        server = mcstatus.MinecraftServer.lookup(api.util.CONFIG['worldHost'] if world.is_main else '{}.{}'.format(world, api.util.CONFIG['worldHost']))
+        try:
+            status = server.status()
+        except (OSError, ValueError):
+            result['list'] = []
+        else:
+            result['list'] = [str(api.util2.Player(player.id)) for player in (status.players.sample or [])]
+    result['updated'] = '{:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.utcnow())
+    return result
+
+def _timed_probe(world):
+    started = time.monotonic()
+    return started, probe(world)
+
+def _probe_done(world_name, future):
+    with _snapshot_lock:
+        if _pending.get(world_name) is future:
+            del _pending[world_name]
+        try:
+            started, status = future.result()
+        except Exception:
+            traceback.print_exc()
+            return
+        if world_name not in _snapshot or _snapshot[world_name][0] < started: # may be called late for an older probe, e.g. by _wait_for_probes
+            _snapshot[world_name] = started, status
+
+def _submit(world):
+    # starts a probe of the world unless one is still running, and returns its future
+    with _snapshot_lock:
+        future = _pending.get(world.name)
+        if future is not None:
+            return future
+        future = _pending[world.name] = _executor.submit(_timed_probe, world)
+    future.add_done_callback(lambda future: _probe_done(world.name, future))
+    return future
+
+def _wait_for_probes(worlds):
+    futures = {world.name: _submit(world) for world in worlds}
+    concurrent.futures.wait(futures.values(), timeout=PROBE_TIMEOUT)
+    for world_name, future in futures.items():
+        if future.done():
+            _probe_done(world_name, future) # wait may return before the done callback has run
+
+def poll():
+    """Starts a probe of every world whose previous probe has finished, and forgets the status of worlds which no longer exist."""
+    worlds = list(minecraft.worlds())
+    with _snapshot_lock:
+        for world_name in set(_snapshot) - {world.name for world in worlds}:
+            del _snapshot[world_name]
+    for world in worlds:
+        _submit(world)
+
+def _run_poller(interval, stop_event):
+    while not stop_event.is_set():
+        try:
+            poll()
+        except Exception:
+            traceback.print_exc()
+        stop_event.wait(interval)
+
+def start_poller(interval=POLL_INTERVAL):
+    """Starts the background thread that keeps the status snapshot of all worlds up to date, unless it is already running."""
+    global _executor, _poller, _poller_stop
+
+    with _poller_lock:
+        if _poller is None or not _poller.is_alive(): # threads don't survive forking
+            with _snapshot_lock:
+                _executor = concurrent.futures.ThreadPoolExecutor(max_workers=PROBE_WORKERS)
+                _pending.clear()
+            _poller_stop = threading.Event()
+            _poller = threading.Thread(target=_run_poller, args=(interval, _poller_stop), name='world status poller', daemon=True)
+            _poller.start()
+
+def stop_poller():
+    """Stops the background poller and waits for running probes to finish, so that no thread holds a lock of this module, e.g. before forking. The snapshot is kept, and the poller is started again by the next status lookup."""
+    global _poller
+
+    with _poller_lock:
+        if _poller is None:
+            return
+        _poller_stop.set()
+        _poller.join()
+        _executor.shutdown(wait=True)
+        _poller = None
+
+def world_status(world):
+    """Returns a copy of the latest status of the world from the snapshot, or None if the world hasn't been probed successfully yet.
+
+    If the world is not in the snapshot, this waits up to PROBE_TIMEOUT seconds for its first probe.
+    """
+    start_poller()
+    with _snapshot_lock:
+        result = _snapshot.get(world.name)
+    if result is None:
+        _wait_for_probes([world])
+        with _snapshot_lock:
+            result = _snapshot.get(world.name)
+    if result is None:
+        return None
+    return dict(result[1])
+
+def world_statuses():
+    """Returns a dict mapping world names to copies of their latest statuses from the snapshot, waiting up to PROBE_TIMEOUT seconds for worlds which haven't been probed yet. Worlds whose status is still unknown are omitted."""
+    start_poller()
+    worlds = list(minecraft.worlds())
+    with _snapshot_lock:
+        missing = [world for world in worlds if world.name not in _snapshot]
+    if len(missing) > 0:
+        _wait_for_probes(missing)
+    with _snapshot_lock:
+        return {world.name: dict(_snapshot[world.name][1]) for world in worlds if world.name in _snapshot}
@@ -0,0 +1,201 @@
+import contextlib
+import json
+import minecraft
+import sqlite3
+import threading
+import time
+import traceback
+
+import api.region
+import api.util
+import api.util2
+
+INDEX_INTERVAL = 60 # seconds between index updates
+SCHEMA = [
+    'DROP TABLE IF EXISTS columns',
+    'DROP TABLE IF EXISTS tile_entities',
+    'DROP TABLE IF EXISTS items',
+    'CREATE TABLE columns (dimension TEXT, x INTEGER, z INTEGER, timestamp INTEGER, PRIMARY KEY (dimension, x, z))',
+    'CREATE TABLE tile_entities (dimension TEXT, column_x INTEGER, column_z INTEGER, x INTEGER, y INTEGER, z INTEGER, id TEXT, text TEXT, data TEXT)',
+    'CREATE INDEX tile_entities_column ON tile_entities (dimension, column_x, column_z)',
+    'CREATE INDEX tile_entities_id ON tile_entities (id)',
+    'CREATE TABLE items (tile_entity INTEGER, id TEXT)',
+    'CREATE INDEX items_id ON items (id)',
+    'CREATE INDEX items_tile_entity ON items (tile_entity)'
+]
+SCHEMA_VERSION = 1
+
+_indexer = None
+_indexer_lock = threading.Lock()
+
+def index_path(world):
+    return api.util.CONFIG['cache'] / 'tile-entities' / '{}.sqlite'.format(world)
+
+def connect(world):
+    """Opens the tile entity index for the world, creating or upgrading it if necessary. If the cache directory doesn't exist, an empty in-memory index is returned instead, see search."""
+    if api.util.CONFIG['cache'].exists():
+        path = index_path(world)
+        if not path.parent.exists():
+            path.parent.mkdir()
+        path = str(path)
+    else:
+        path = ':memory:'
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+        # migrate in a single write transaction so concurrent first connections don't race
+        connection.isolation_level = None # don't let the sqlite3 module commit before the DDL statements
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION: # another connection may have migrated while we waited for the lock
+                    for statement in SCHEMA:
+                        connection.execute(statement)
+                    connection.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+            except:
+                connection.execute('ROLLBACK')
+                raise
+            else:
+                connection.execute('COMMIT')
+        finally:
+            connection.isolation_level = ''
+    return connection
+
+def text_component_to_plain(component):
+    """Returns the plain text of a JSON text component, as used on signs since 1.8."""
+    if isinstance(component, str):
+        return component
+    if isinstance(component, list):
+        return ''.join(text_component_to_plain(child) for child in component)
+    if isinstance(component, dict):
+        return component.get('text', '') + ''.join(text_component_to_plain(child) for child in component.get('extra', []))
+    return str(component)
+
+def tile_entity_text(tile_entity):
+    """Returns the searchable text of a tile entity: sign lines and custom names."""
+    lines = []
+    for key in ('Text1', 'Text2', 'Text3', 'Text4', 'CustomName'):
+        if key in tile_entity:
+            try:
+                lines.append(text_component_to_plain(json.loads(tile_entity[key])))
+            except ValueError:
+                lines.append(tile_entity[key]) # pre-1.8 plain text
+    return '\n'.join(lines)
+
+def tile_entity_items(tile_entity):
+    """Yields the IDs of all items stored in a tile entity, including the contents of shulker boxes."""
+    for item in tile_entity.get('Items', []):
+        if 'id' in item:
+            yield str(item['id'])
+        if 'BlockEntityTag' in item.get('tag', {}):
+            yield from tile_entity_items(item['tag']['BlockEntityTag'])
+
+def _delete_column(connection, dimension, x, z):
+    connection.execute('DELETE FROM items WHERE tile_entity IN (SELECT rowid FROM tile_entities WHERE dimension = ? AND column_x = ? AND column_z = ?)', (dimension.name, x, z))
+    connection.execute('DELETE FROM tile_entities WHERE dimension = ? AND column_x = ? AND column_z = ?', (dimension.name, x, z))
+    connection.execute('DELETE FROM columns WHERE dimension = ? AND x = ? AND z = ?', (dimension.name, x, z))
+
+def update_index(world):
+    """Re-indexes the tile entities of all chunk columns in the world whose timestamps in the region headers changed since the last update. Does nothing if the cache directory doesn't exist, since the index wouldn't be kept."""
+    if not api.util.CONFIG['cache'].exists():
+        return
+    with contextlib.closing(connect(world)) as connection:
+        _update_index(connection, world)
+
+def _update_index(connection, world):
+    import mcanvil
+
+    for dimension in api.util2.Dimension:
+        indexed = {(x, z): timestamp for x, z, timestamp in connection.execute('SELECT x, z, timestamp FROM columns WHERE dimension = ?', (dimension.name,))}
+        if dimension.region_path(world).exists():
+            region_paths = [region_path for region_path in dimension.region_path(world).iterdir() if api.region.region_coords(region_path) is not None]
+        else:
+            region_paths = []
+        for region_path in region_paths:
+            region = None
+            with connection:
+                for (x, z), timestamp in api.region.chunk_timestamps(region_path).items():
+                    if indexed.pop((x, z), None) == timestamp:
+                        continue
+                    if region is None:
+                        region = mcanvil.Region(region_path)
+                    column = api.util2.nbt_to_dict(region.chunk_column(x, z).data)
+                    _delete_column(connection, dimension, x, z)
+                    for tile_entity in column['Level'].get('TileEntities', []):
+                        rowid = connection.execute('INSERT INTO tile_entities (dimension, column_x, column_z, x, y, z, id, text, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (dimension.name, x, z, tile_entity['x'], tile_entity['y'], tile_entity['z'], tile_entity.get('id'), tile_entity_text(tile_entity), json.dumps(tile_entity))).lastrowid
+                        connection.executemany('INSERT INTO items (tile_entity, id) VALUES (?, ?)', [(rowid, item_id) for item_id in set(tile_entity_items(tile_entity))])
+                    connection.execute('INSERT INTO columns (dimension, x, z, timestamp) VALUES (?, ?, ?, ?)', (dimension.name, x, z, timestamp))
+        # columns that were deleted or whose region file was deleted
+        with connection:
+            for x, z in indexed:
+                _delete_column(connection, dimension, x, z)
+
+def _run_indexer(interval):
+    while True:
+        for world in minecraft.worlds():
+            try:
+                update_index(world)
+            except Exception:
+                traceback.print_exc()
+        time.sleep(interval)
+
+def start_indexer(interval=INDEX_INTERVAL):
+    """Starts the background thread that keeps the tile entity indexes of all worlds up to date, unless it is already running or background work is disabled in this process (see api.util2.set_background_work)."""
+    global _indexer
+
+    if not api.util2.background_work_enabled():
+        return
+    with _indexer_lock:
+        if _indexer is None or not _indexer.is_alive(): # threads don't survive forking, e.g. when warming up before starting prefork workers
+            _indexer = threading.Thread(target=_run_indexer, args=(interval,), name='tile entity indexer', daemon=True)
+            _indexer.start()
+
+def search(world, *, dimension=None, tile_entity_id=None, text=None, item=None, bbox=None, limit=None):
+    """Returns a list of tile entities from the index matching all of the given criteria.
+
+    Keyword-only arguments:
+    dimension -- Only return tile entities in this api.util2.Dimension.
+    tile_entity_id -- Only return tile entities with this ID. The minecraft: prefix may be omitted.
+    text -- Only return tile entities whose sign text or custom name contains this string, ignoring case.
+    item -- Only return tile entities containing an item with this ID. The minecraft: prefix may be omitted.
+    bbox -- A pair of (x, y, z) tuples. Only return tile entities within the box with these corners (inclusive).
+    limit -- The maximum number of tile entities to return. Must not be negative.
+
+    Each tile entity is returned as a dict of its NBT data, with the added key "dimension". If the cache directory doesn't exist, there is no index kept by the background indexer, so the world is indexed into an in-memory database for each search instead.
+    """
+    if limit is not None and limit < 0:
+        raise ValueError('limit must not be negative') # SQLite would treat it as no limit
+    conditions = []
+    params = []
+    if dimension is not None:
+        conditions.append('dimension = ?')
+        params.append(dimension.name)
+    if tile_entity_id is not None:
+        conditions.append('id IN (?, ?)')
+        params += [tile_entity_id, 'minecraft:{}'.format(tile_entity_id)]
+    if text is not None:
+        conditions.append("text LIKE ? ESCAPE '\\'")
+        params.append('%{}%'.format(text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')))
+    if item is not None:
+        conditions.append('rowid IN (SELECT tile_entity FROM items WHERE id IN (?, ?))')
+        params += [item, 'minecraft:{}'.format(item)]
+    if bbox is not None:
+        (min_x, min_y, min_z), (max_x, max_y, max_z) = bbox
+        conditions.append('x BETWEEN ? AND ? AND y BETWEEN ? AND ? AND z BETWEEN ? AND ?')
+        params += [min(min_x, max_x), max(min_x, max_x), min(min_y, max_y), max(min_y, max_y), min(min_z, max_z), max(min_z, max_z)]
+    query = 'SELECT dimension, data FROM tile_entities'
+    if len(conditions) > 0:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY dimension, x, y, z'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    result = []
+    with contextlib.closing(connect(world)) as connection:
+        if not api.util.CONFIG['cache'].exists():
+            _update_index(connection, world)
+        for dimension_name, data in connection.execute(query, params):
+            tile_entity = json.loads(data)
+            tile_entity['dimension'] = dimension_name
+            result.append(tile_entity)
+    return result
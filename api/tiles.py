@@ -0,0 +1,346 @@
+import collections
+import contextlib
+import json
+
+import api.region
+import api.util
+import api.util2
+
+MAX_ZOOM = 8
+TILE_SIZE = api.region.REGION_WIDTH * 16
+
+BLOCK_MAP_COLORS = { # numeric block ID: base color index into api.util.MAP_PALETTE, for blocks that don't use the stone color
+    0: 0, # air
+    2: 1, # grass block
+    3: 10, # dirt
+    5: 13, # planks
+    6: 7, # sapling
+    8: 12, # flowing water
+    9: 12, # water
+    10: 4, # flowing lava
+    11: 4, # lava
+    12: 2, # sand
+    17: 13, # log
+    18: 7, # leaves
+    19: 18, # sponge
+    20: 0, # glass
+    24: 2, # sandstone
+    31: 7, # tall grass
+    32: 13, # dead bush
+    35: 8, # wool
+    37: 7, # dandelion
+    38: 7, # flower
+    39: 0, # brown mushroom
+    40: 0, # red mushroom
+    41: 30, # gold block
+    42: 6, # iron block
+    45: 28, # bricks
+    46: 4, # TNT
+    47: 13, # bookshelf
+    49: 29, # obsidian
+    50: 0, # torch
+    51: 4, # fire
+    53: 13, # oak stairs
+    54: 13, # chest
+    57: 31, # diamond block
+    58: 13, # crafting table
+    59: 7, # wheat
+    60: 10, # farmland
+    63: 0, # standing sign
+    64: 13, # oak door
+    65: 0, # ladder
+    66: 0, # rail
+    68: 0, # wall sign
+    75: 0, # unlit redstone torch
+    76: 0, # redstone torch
+    78: 8, # snow layer
+    79: 5, # ice
+    80: 8, # snow block
+    81: 7, # cactus
+    82: 9, # clay
+    83: 7, # sugar cane
+    85: 13, # oak fence
+    86: 15, # pumpkin
+    87: 35, # netherrack
+    88: 26, # soul sand
+    89: 2, # glowstone
+    91: 15, # jack o'lantern
+    99: 10, # brown mushroom block
+    100: 4, # red mushroom block
+    102: 0, # glass pane
+    103: 19, # melon
+    106: 7, # vines
+    110: 24, # mycelium
+    111: 7, # lily pad
+    112: 35, # nether brick
+    121: 2, # end stone
+    133: 33, # emerald block
+    134: 13, # spruce stairs
+    135: 13, # birch stairs
+    136: 13, # jungle stairs
+    155: 14, # quartz block
+    156: 14, # quartz stairs
+    159: 15, # stained clay
+    161: 7, # leaves
+    162: 13, # log
+    172: 15, # hardened clay
+    174: 5, # packed ice
+    175: 7, # large flower
+    179: 15, # red sandstone
+    180: 15 # red sandstone stairs
+}
+DEFAULT_MAP_COLOR = 11 # stone
+
+def tile_path(world, dimension, zoom, x, y):
+    """Returns the path of a tile in the tile cache. Tiles may be evicted from the cache once it grows beyond the tileCacheSize config value in bytes, in which case update_tiles renders them again."""
+    return api.util.CONFIG['cache'] / 'map-tiles' / str(world) / dimension.name / str(zoom) / str(x) / '{}.png'.format(y)
+
+def column_surface(column):
+    """Returns a list of 256 (height, color) pairs for the topmost visible block in each x/z position of a chunk column, indexed by 16 * z + x.
+
+    The color is a base color index into api.util.MAP_PALETTE, and the height is the y coordinate of the block. Positions with only transparent blocks get (-1, 0).
+    """
+    sections = {section['Y']: section for section in column['Level']['Sections']}
+    result = []
+    for i, height in enumerate(column['Level']['HeightMap']):
+        y = min(height, 256) - 1
+        while y >= 0:
+            section = sections.get(y // 16)
+            if section is not None:
+                block_index = 256 * (y & 15) + i
+                block_id = section['Blocks'][block_index]
+                if 'Add' in section:
+                    block_id += api.util2.nybble(section['Add'], block_index) << 8
+                color = BLOCK_MAP_COLORS.get(block_id, DEFAULT_MAP_COLOR)
+                if color != 0:
+                    result.append((y, color))
+                    break
+            y -= 1
+        else:
+            result.append((-1, 0))
+    return result
+
+def surface_image_data(surface, north_heights=None):
+    """Returns the 16×16px top-down render of a chunk column surface (see column_surface) as raw RGBA bytes. Blocks are shaded like on map items, by comparing their height to the block to the north.
+
+    north_heights is the list of the 16 heights of the southernmost row of the chunk column to the north, used to shade the northernmost row. If it's None, that row is shaded as if it was flat.
+    """
+    result = bytearray()
+    for i, (height, color) in enumerate(surface):
+        if i >= 16:
+            north_height = surface[i - 16][0]
+        elif north_heights is not None:
+            north_height = north_heights[i]
+        else:
+            north_height = height
+        if height > north_height:
+            shade = 2
+        elif height == north_height:
+            shade = 1
+        else:
+            shade = 0
+        result += bytes(api.util.map_color(4 * color + shade))
+    return bytes(result)
+
+def column_image_data(column, north_heights=None):
+    """Returns the 16×16px top-down render of a chunk column as raw RGBA bytes, see surface_image_data."""
+    return surface_image_data(column_surface(column), north_heights)
+
+def _sibling_tile_path(image_path, x, y):
+    # the path of another tile on the same zoom level as image_path, without needing the world, so it works in worker processes
+    return image_path.parent.parent / str(x) / '{}.png'.format(y)
+
+def _file_size(path):
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+def _read_render_info(info_path):
+    # the data stored next to a zoom level MAX_ZOOM tile by render_region, or None if it's missing or from an older version
+    try:
+        with info_path.open() as info_f:
+            info = json.load(info_f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(info, dict) or set(info) != {'northEdge', 'southHeights', 'timestamps'}:
+        return None
+    return info
+
+def render_region(region_path, image_path):
+    """Updates the zoom level MAX_ZOOM tile for a region file by re-rendering only the chunk columns which changed.
+
+    A chunk column is re-rendered if its timestamp in the region header changed, or if the heights of the southernmost row of the chunk column to its north changed, since they determine the shading of its northernmost row. For the northernmost chunk columns of the region, these heights are taken from the render of the region to the north, if any.
+
+    The header timestamps, the heights of the southernmost row of each chunk column, and the heights used for the northern edge are stored next to the image. They are compared before the image is opened, so nothing is decoded if no chunk column needs to be repainted. If the files were written, returns the change in size of these two files in bytes, otherwise None.
+    """
+    import PIL.Image
+    import mcanvil
+
+    locations, timestamps = api.region.read_header(region_path)
+    timestamps = [timestamp if location != 0 else None for location, timestamp in zip(locations, timestamps)]
+    info_path = image_path.with_suffix('.json')
+    region_x, region_z = api.region.region_coords(region_path)
+    north_info = _read_render_info(_sibling_tile_path(image_path, region_x, region_z - 1).with_suffix('.json'))
+    if north_info is None:
+        north_edge = [None] * api.region.REGION_WIDTH
+    else:
+        north_edge = north_info['southHeights'][-api.region.REGION_WIDTH:]
+    info = _read_render_info(info_path)
+    if info is None or not image_path.exists():
+        info = {
+            'northEdge': [None] * api.region.REGION_WIDTH,
+            'southHeights': [None] * api.region.REGION_WIDTH ** 2,
+            'timestamps': [None] * api.region.REGION_WIDTH ** 2
+        }
+        image = PIL.Image.new('RGBA', (TILE_SIZE, TILE_SIZE), color=(0, 0, 0, 0))
+        image_changed = True # also write the image if no chunk columns have been generated yet
+    else:
+        image = None # opened once a chunk column needs to be repainted
+        image_changed = False
+    old_south_heights = list(info['southHeights'])
+    region = None
+    for i in range(api.region.REGION_WIDTH ** 2): # row by row from north to south, so each chunk column's northern neighbour is up to date
+        z, x = divmod(i, api.region.REGION_WIDTH)
+        if z == 0:
+            north_heights, old_north_heights = north_edge[x], info['northEdge'][x]
+        else:
+            north_heights, old_north_heights = info['southHeights'][i - api.region.REGION_WIDTH], old_south_heights[i - api.region.REGION_WIDTH]
+        if timestamps[i] == info['timestamps'][i] and north_heights == old_north_heights:
+            continue
+        if image is None:
+            try:
+                image = PIL.Image.open(str(image_path))
+                image.load()
+            except (OSError, ValueError): # unreadable, render the whole region again
+                old_size = _file_size(image_path)
+                with contextlib.suppress(FileNotFoundError):
+                    image_path.unlink()
+                return render_region(region_path, image_path) - old_size
+        if timestamps[i] is None:
+            image.paste((0, 0, 0, 0), (16 * x, 16 * z, 16 * x + 16, 16 * z + 16))
+            info['southHeights'][i] = None
+        else:
+            if region is None:
+                region = mcanvil.Region(region_path)
+            column = api.util2.nbt_to_dict(region.chunk_column(api.region.REGION_WIDTH * region_x + x, api.region.REGION_WIDTH * region_z + z).data)
+            surface = column_surface(column)
+            image.paste(PIL.Image.frombytes('RGBA', (16, 16), surface_image_data(surface, north_heights)), (16 * x, 16 * z))
+            info['southHeights'][i] = [height for height, _ in surface[-16:]]
+        info['timestamps'][i] = timestamps[i]
+        image_changed = True
+    if north_edge != info['northEdge']:
+        info['northEdge'] = north_edge
+        image_changed = True
+    if not image_changed:
+        return None
+    old_size = _file_size(image_path) + _file_size(info_path)
+    if image is not None: # None if only the stored edge heights changed
+        with api.util2.atomic_write(image_path, 'wb') as image_f:
+            image.save(image_f, 'PNG')
+    with api.util2.atomic_write(info_path) as info_f:
+        json.dump(info, info_f)
+    return _file_size(image_path) + _file_size(info_path) - old_size
+
+def _render_region_task(task):
+    return render_region(*task)
+
+def compose_tile(world, dimension, zoom, x, y):
+    """Renders a tile on zoom level MAX_ZOOM - 1 or lower from the four tiles above it. If none of them exist, the tile is deleted instead. Returns the change in size of the tile in bytes."""
+    import PIL.Image
+
+    image = PIL.Image.new('RGBA', (TILE_SIZE, TILE_SIZE), color=(0, 0, 0, 0))
+    any_children = False
+    for child_x in range(2):
+        for child_y in range(2):
+            child_path = tile_path(world, dimension, zoom + 1, 2 * x + child_x, 2 * y + child_y)
+            if child_path.exists():
+                any_children = True
+                child = PIL.Image.open(str(child_path)).convert('RGBA').resize((TILE_SIZE // 2, TILE_SIZE // 2), PIL.Image.BILINEAR)
+                image.paste(child, (child_x * TILE_SIZE // 2, child_y * TILE_SIZE // 2))
+    path = tile_path(world, dimension, zoom, x, y)
+    old_size = _file_size(path)
+    if not any_children:
+        with contextlib.suppress(FileNotFoundError):
+            path.unlink()
+        return -old_size
+    with api.util2.atomic_write(path, 'wb') as image_f:
+        image.save(image_f, 'PNG')
+    return _file_size(path) - old_size
+
+def _rendered_regions(world, dimension):
+    # yields the coordinates of all tiles on zoom level MAX_ZOOM which have been rendered
+    level_path = tile_path(world, dimension, MAX_ZOOM, 0, 0).parent.parent
+    if not level_path.exists():
+        return
+    for x_path in level_path.iterdir():
+        for image_path in x_path.glob('*.png'):
+            try:
+                yield int(x_path.name), int(image_path.stem)
+            except ValueError:
+                continue
+
+TILE_FLIGHTS = api.util2.SingleFlight() # coalesces concurrent updates of the same tiles, see update_tiles
+
+def update_tiles(world, dimension, zoom=0, x=None, y=None):
+    """Brings tiles up to date with the region files, re-rendering only what changed.
+
+    Zoom levels follow the usual web map convention: on zoom level MAX_ZOOM, each tile shows one region at one pixel per block, and each tile on a lower zoom level is composed of four tiles on the level above it.
+
+    Required arguments:
+    world -- a minecraft.World
+    dimension -- an api.util2.Dimension
+
+    Optional arguments:
+    zoom -- The lowest zoom level to update. Defaults to 0.
+    x, y -- The coordinates of a tile on the given zoom level. If given, only that tile and the tiles it is composed of are updated. Otherwise, all tiles down to the given zoom level are updated.
+
+    Region tiles are rendered in parallel worker processes. Tiles of regions which have been deleted are deleted as well. Tiles which have been evicted from the tile cache are rendered again. Concurrent calls with the same arguments wait for a single update.
+    """
+    TILE_FLIGHTS((str(world), dimension.name, zoom, x, y), _update_tiles, world, dimension, zoom, x, y)
+
+def _update_tiles(world, dimension, zoom, x, y):
+    shift = MAX_ZOOM - zoom
+
+    def in_area(coords):
+        return x is None or (coords[0] >> shift, coords[1] >> shift) == (x, y)
+
+    tasks = []
+    if dimension.region_path(world).exists():
+        for region_path in dimension.region_path(world).iterdir():
+            coords = api.region.region_coords(region_path)
+            if coords is None or not in_area(coords):
+                continue
+            tasks.append((region_path, tile_path(world, dimension, MAX_ZOOM, *coords)))
+    size_changes = api.region.map_regions(_render_region_task, tasks)
+    rendered = {api.region.region_coords(region_path) for (region_path, _), size_change in size_changes.items() if size_change is not None}
+    size_change = sum(size_change for size_change in size_changes.values() if size_change is not None)
+    # regions rendered in parallel with the region to their north may have used its old edge heights
+    size_changes = api.region.map_regions(_render_region_task, [(region_path, image_path) for region_path, image_path in tasks if (api.region.region_coords(region_path)[0], api.region.region_coords(region_path)[1] - 1) in rendered])
+    size_change += sum(size_change for size_change in size_changes.values() if size_change is not None)
+    tiles = {api.region.region_coords(region_path) for region_path, _ in tasks}
+    # tiles of deleted regions
+    removed = {coords for coords in _rendered_regions(world, dimension) if in_area(coords)} - tiles
+    for coords in removed:
+        for path in (tile_path(world, dimension, MAX_ZOOM, *coords), tile_path(world, dimension, MAX_ZOOM, *coords).with_suffix('.json')):
+            size_change -= _file_size(path)
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+    for level in range(MAX_ZOOM - 1, zoom - 1, -1):
+        parents = collections.defaultdict(list)
+        for tile_x, tile_y in tiles:
+            parents[tile_x >> 1, tile_y >> 1].append(tile_path(world, dimension, level + 1, tile_x, tile_y))
+        removed_parents = {(tile_x >> 1, tile_y >> 1) for tile_x, tile_y in removed}
+        for parent in removed_parents:
+            parents.setdefault(parent, [])
+        for (parent_x, parent_y), children in parents.items():
+            parent_path = tile_path(world, dimension, level, parent_x, parent_y)
+            try:
+                if (parent_x, parent_y) not in removed_parents and all(child_path.stat().st_mtime <= parent_path.stat().st_mtime for child_path in children):
+                    continue
+            except FileNotFoundError: # not rendered yet, or evicted from the tile cache
+                pass
+            size_change += compose_tile(world, dimension, level, parent_x, parent_y)
+        tiles = set(parents)
+        removed = removed_parents
+    api.util2.disk_cache_add('map-tiles', size_change, api.util.CONFIG['tileCacheSize'])
@@ -63,6 +63,57 @@ class Bottle(bottle.Bottle):
     def default_error_handler(self, res):
         return bottle.tob(bottle.template(ERROR_PAGE_TEMPLATE, e=res))
 
+MAP_PALETTE = [
+    (0, 0, 0), # special-cased to transparent
+    (125, 176, 55),
+    (244, 230, 161),
+    (197, 197, 197),
+    (252, 0, 0),
+    (158, 158, 252),
+    (165, 165, 165),
+    (0, 123, 0),
+    (252, 252, 252),
+    (162, 166, 182),
+    (149, 108, 76),
+    (111, 111, 111),
+    (63, 63, 252),
+    (141, 118, 71),
+    (252, 249, 242),
+    (213, 125, 50),
+    (176, 75, 213),
+    (101, 151, 213),
+    (226, 226, 50),
+    (125, 202, 25),
+    (239, 125, 163),
+    (75, 75, 75),
+    (151, 151, 151),
+    (75, 125, 151),
+    (125, 62, 176),
+    (50, 75, 176),
+    (101, 75, 50),
+    (101, 125, 50),
+    (151, 50, 50),
+    (25, 25, 25),
+    (247, 235, 76),
+    (91, 216, 210),
+    (73, 129, 252),
+    (0, 214, 57),
+    (21, 20, 31),
+    (112, 2, 0),
+    (127, 85, 48)
+]
+
+MAP_SHADES = [180, 220, 255, 135]
+
+def map_color(color):
+    """Returns the RGBA tuple for a color byte from map item data, with the base color in the upper 6 bits and the shade in the lower 2."""
+    base_color, color_variant = divmod(color, 4)
+    if base_color == 0:
+        return 0, 0, 0, 0
+    return tuple(round(palette_color * MAP_SHADES[color_variant] / 255) for palette_color in MAP_PALETTE[base_color]) + (255,)
+
+MAP_COLOR_CHANNELS = [list(channel) for channel in zip(*(map_color(color) if color // 4 < len(MAP_PALETTE) else (0, 0, 0, 0) for color in range(256)))] # lookup tables from color bytes to the red, green, blue, and alpha values
+
 def map_image(map_dict):
     """Returns a PIL.Image.Image object of the map.
 
@@ -71,54 +122,21 @@ def map_image(map_dict):
     """
     import PIL.Image
 
-    map_palette = [
-        (0, 0, 0), # special-cased to transparent in the code below
-        (125, 176, 55),
-        (244, 230, 161),
-        (197, 197, 197),
-        (252, 0, 0),
-        (158, 158, 252),
-        (165, 165, 165),
-        (0, 123, 0),
-        (252, 252, 252),
-        (162, 166, 182),
-        (149, 108, 76),
-        (111, 111, 111),
-        (63, 63, 252),
-        (141, 118, 71),
-        (252, 249, 242),
-        (213, 125, 50),
-        (176, 75, 213),
-        (101, 151, 213),
-        (226, 226, 50),
-        (125, 202, 25),
-        (239, 125, 163),
-        (75, 75, 75),
-        (151, 151, 151),
-        (75, 125, 151),
-        (125, 62, 176),
-        (50, 75, 176),
-        (101, 75, 50),
-        (101, 125, 50),
-        (151, 50, 50),
-        (25, 25, 25),
-        (247, 235, 76),
-        (91, 216, 210),
-        (73, 129, 252),
-        (0, 214, 57),
-        (21, 20, 31),
-        (112, 2, 0),
-        (127, 85, 48)
-    ]
-    ret = PIL.Image.new('RGBA', (map_dict['data']['width'], map_dict['data']['height']), color=(0, 0, 0, 0))
-    for i, color in enumerate(map_dict['data']['colors']):
-        y, x = divmod(i, map_dict['data']['width'])
-        base_color, color_variant = divmod(color, 4)
-        if base_color == 0:
-            continue
-        color = tuple(round(palette_color * [180, 220, 255, 135][color_variant] / 255) for palette_color in map_palette[base_color]) + (255,)
-        ret.putpixel((x, y), color)
-    return ret
+    size = map_dict['data']['width'], map_dict['data']['height']
+    color_indices = PIL.Image.frombytes('L', size, bytes(map_dict['data']['colors']))
+    return PIL.Image.merge('RGBA', [color_indices.point(channel) for channel in MAP_COLOR_CHANNELS])
+
+def dye_image(image, color):
+    """Returns an RGBA image multiplied with a color, like PIL.ImageChops.multiply with a solid image of that color, but using one lookup table per channel.
+
+    Required arguments:
+    image -- A PIL.Image.Image in RGBA mode
+    color -- An (r, g, b) tuple of ints from 0 to 255
+    """
+    lut = []
+    for channel in color + (255,):
+        lut += [value * channel // 255 for value in range(256)]
+    return image.point(lut)
 
 def format_stats(stats):
     ret = {}
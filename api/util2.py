@@ -1,27 +1,196 @@
+import base64
 import bottle
+import collections
+import concurrent.futures
+import contextlib
 import copy
 import datetime
+import email.utils
 import enum
 import functools
+import hashlib
 import inspect
 import io
 import json
+import math
 import minecraft
+import more_itertools
 import nbt.nbt
+import os
 import os.path
 import pathlib
 import random
 import re
 import requests
+import struct
 import time
 import tempfile
+import threading
+import traceback
 import types
 import uuid
+import zlib
 
 import api.util
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
 PLAYER_CACHE = {}
 
+class LRUCache:
+    """A thread-safe mapping that holds at most maxsize items, dropping the least recently used ones first."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.items[key]
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.items[key]
+            self.items.move_to_end(key)
+            return value
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+class SingleFlight:
+    """Coalesces concurrent calls: while a call for a key is in progress, other callers with the same key wait for it and share its result or exception instead of computing it again."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.exception = None
+            self.result = None
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, key, func, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self.calls[key] = self._Call()
+        if is_leader:
+            try:
+                call.result = func(*args, **kwargs)
+            except BaseException as e:
+                call.exception = e
+                raise
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+            return call.result
+        call.done.wait()
+        if call.exception is not None:
+            raise call.exception
+        return call.result
+
+class Memo:
+    """Values computed once and shared by all code running in the same memo scope, see memo_scope."""
+
+    def __init__(self):
+        self.values = {}
+        self.flights = SingleFlight()
+
+    def get(self, key, func):
+        """Returns the value for key, calling func without arguments to compute it if it's not in the memo yet. Concurrent calls for the same key from threads sharing the memo compute it only once."""
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+
+        def compute():
+            if key not in self.values:
+                self.values[key] = func()
+            return self.values[key]
+
+        return self.flights(key, compute)
+
+_memo_scopes = threading.local()
+
+@contextlib.contextmanager
+def memo_scope(memo=None):
+    """Makes memoized calls in the current thread share a Memo for the duration of the with block. Pass the same Memo to scopes in several threads to share it between them. Yields the Memo."""
+    if memo is None:
+        memo = Memo()
+    old_memo = getattr(_memo_scopes, 'memo', None)
+    _memo_scopes.memo = memo
+    try:
+        yield memo
+    finally:
+        _memo_scopes.memo = old_memo
+
+def start_request_memo(memo=None):
+    """Replaces the current thread's memo with the given Memo, or a new one, for a request that is about to be handled. Unlike memo_scope, this lasts until end_request_memo is called. Responses streamed after that, like those of json_route, keep using the memo in a memo_scope of their own."""
+    _memo_scopes.memo = Memo() if memo is None else memo
+
+def end_request_memo():
+    """Removes the current thread's memo once a request has been handled, so that the memoized values aren't kept alive, or reused by unrelated code running in the same thread later."""
+    _memo_scopes.memo = None
+
+def memoized(key, func):
+    """Returns func() computed at most once per memo scope for the given key, or simply func() outside of a memo scope. Callers must not modify the returned value."""
+    memo = getattr(_memo_scopes, 'memo', None)
+    if memo is None:
+        return func()
+    return memo.get(key, func)
+
+def load_json(path):
+    """Returns the parsed contents of a JSON file. Within a memo scope, each version of the file is parsed only once. Callers must not modify the returned value."""
+    def load():
+        with path.open() as f:
+            return json.load(f)
+
+    path = pathlib.Path(path)
+    return memoized(('json', str(path), path.stat().st_mtime_ns), load)
+
+def people_dump():
+    """Returns the people database in version 3 format. Within a memo scope, each version of the database (see people_version) is only dumped once. Callers must not modify the returned value."""
+    import people
+
+    return memoized(('people', people_version()), lambda: people.get_people_db().obj_dump(version=3))
+
 @enum.unique
 class Dimension(enum.Enum):
     overworld = 0
@@ -42,7 +211,7 @@ class Player:
 
             db = people.get_people_db()
             self.wurstmineberg_id = player_id
-            self.data = db.obj_dump(version=3)['people'][self.wurstmineberg_id]
+            self.data = copy.deepcopy(people_dump()['people'][self.wurstmineberg_id])
             self.uuid = None
         elif isinstance(player_id, uuid.UUID):
             self.uuid = player_id
@@ -60,7 +229,7 @@ class Player:
                 self.data = None
             else:
                 db = people.get_people_db()
-                for wurstmineberg_id, person_data in db.obj_dump(version=3)['people'].items():
+                for wurstmineberg_id, person_data in people_dump()['people'].items():
                     if 'minecraft' in person_data:
                         if 'uuid' in person_data['minecraft']:
                             person_uuid = uuid.UUID(person_data['minecraft']['uuid'])
@@ -71,7 +240,7 @@ class Player:
                             continue
                         if person_uuid == self.uuid:
                             self.wurstmineberg_id = wurstmineberg_id
-                            self.data = person_data
+                            self.data = copy.deepcopy(person_data)
                             self.data['minecraft']['uuid'] = str(self.uuid) # make sure the UUID is included in the JSON data
                             break
                 else:
@@ -144,7 +313,7 @@ class Player:
         except ImportError:
             pass # no people db
         else:
-            for wurstmineberg_id in people.get_people_db().obj_dump(version=3)['people']:
+            for wurstmineberg_id in people_dump()['people']:
                 yield from find(wurstmineberg_id)
         # from player data files
         for world in minecraft.worlds():
@@ -225,79 +394,166 @@ def short_world_status(world):
         'whitelist': world.config['whitelist']
     }
 
-def chunk_section_info(column, x, y, z):
-    def nybble(data, idx):
-        result = data[idx // 2]
-        if idx % 2 == 0:
-            return result & 15
-        else:
-            return result >> 4
+def nybble(data, idx):
+    """Returns the 4-bit value at index idx of a byte array packed two values per byte, low nybble first."""
+    result = data[idx // 2]
+    if idx % 2 == 0:
+        return result & 15
+    else:
+        return result >> 4
+
+def block_names():
+    """Returns a dict mapping numeric block IDs to the text IDs from items.json."""
+    with (api.util.CONFIG['webAssets'] / 'json' / 'items.json').open() as items_file:
+        items = json.load(items_file)
+    result = {}
+    for plugin, plugin_items in items.items():
+        for item_id, item_info in plugin_items.items():
+            if 'blockID' in item_info:
+                result.setdefault(item_info['blockID'], '{}:{}'.format(plugin, item_id))
+    return result
+
+def biome_names():
+    """Returns a dict mapping numeric biome IDs to the text IDs from biomes.json."""
+    with (api.util.CONFIG['webAssets'] / 'json' / 'biomes.json').open() as biomes_file:
+        biomes = json.load(biomes_file)
+    return {int(biome_id): biome_info['id'] for biome_id, biome_info in biomes['biomes'].items()}
+
+def block_info(column, section, x, y, z, *, biomes, blocks):
+    """Returns the info about a single block, without entities or tile entities.
+
+    Required arguments:
+    column -- A dict representing the NBT data of the chunk column containing the block
+    section -- The dict from column['Level']['Sections'] for the section containing the block, or None if that section is empty
+    x, y, z -- The absolute block coordinates
+
+    Keyword-only arguments:
+    biomes -- A dict as returned by biome_names
+    blocks -- A dict as returned by block_names
+    """
+    result = {
+        'x': x,
+        'y': y,
+        'z': z
+    }
+    if 'Biomes' in column['Level']:
+        result['biome'] = biomes[column['Level']['Biomes'][16 * (z & 15) + (x & 15)]]
+    if section is not None:
+        block_index = 256 * (y & 15) + 16 * (z & 15) + (x & 15)
+        block_id = section['Blocks'][block_index]
+        if 'Add' in section:
+            block_id += nybble(section['Add'], block_index) << 8
+        result['id'] = blocks.get(block_id, block_id)
+        result['damage'] = nybble(section['Data'], block_index)
+        result['blockLight'] = nybble(section['BlockLight'], block_index)
+        result['skyLight'] = nybble(section['SkyLight'], block_index)
+    return result
+
+def entity_block(entity):
+    """Returns the absolute (x, y, z) coordinates of the block containing the entity."""
+    return tuple(math.floor(coord) for coord in entity['Pos'])
+
+def add_tile_entity(block_info, tile_entity):
+    """Adds a tile entity to a block info dict, removing the redundant coordinates from the tile entity."""
+    del tile_entity['x']
+    del tile_entity['y']
+    del tile_entity['z']
+    if 'tileEntities' in block_info:
+        block_info['tileEntities'].append(tile_entity)
+    elif 'tileEntity' in block_info:
+        block_info['tileEntities'] = [block_info['tileEntity'], tile_entity]
+        del block_info['tileEntity']
+    else:
+        block_info['tileEntity'] = tile_entity
 
+def chunk_section_info(column, x, y, z):
     for section in column['Level']['Sections']:
         if section['Y'] == y:
             break
     else:
         section = None
-    with (api.util.CONFIG['webAssets'] / 'json' / 'biomes.json').open() as biomes_file:
-        biomes = json.load(biomes_file)
-    with (api.util.CONFIG['webAssets'] / 'json' / 'items.json').open() as items_file:
-        items = json.load(items_file)
-    layers = []
-    for layer in range(16):
-        block_y = y * 16 + layer
-        rows = []
-        for row in range(16):
-            block_z = z * 16 + row
-            blocks = []
-            for block in range(16):
-                block_x = x * 16 + block
-                block_info = {
-                    'x': block_x,
-                    'y': block_y,
-                    'z': block_z
-                }
-                if 'Biomes' in column['Level']:
-                    block_info['biome'] = biomes['biomes'][str(column['Level']['Biomes'][16 * row + block])]['id']
-                if section is not None:
-                    block_index = 256 * layer + 16 * row + block
-                    block_id = section['Blocks'][block_index]
-                    if 'Add' in section:
-                        block_id += nybble(section['Add'], block_index) << 8
-                    block_info['id'] = block_id
-                    for plugin, plugin_items in items.items():
-                        for item_id, item_info in plugin_items.items():
-                            if 'blockID' in item_info and item_info['blockID'] == block_id:
-                                block_info['id'] = '{}:{}'.format(plugin, item_id)
-                                break
-                    block_info['damage'] = nybble(section['Data'], block_index)
-                    block_info['blockLight'] = nybble(section['BlockLight'], block_index)
-                    block_info['skyLight'] = nybble(section['SkyLight'], block_index)
-                blocks.append(block_info)
-            rows.append(blocks)
-        layers.append(rows)
+    biomes = biome_names()
+    blocks = block_names()
+    layers = [[[block_info(column, section, x * 16 + block, y * 16 + layer, z * 16 + row, biomes=biomes, blocks=blocks) for block in range(16)] for row in range(16)] for layer in range(16)]
     if 'Entities' in column['Level']:
         for entity in column['Level']['Entities']:
-            if y * 16 <= entity['Pos'][1] < y * 16 + 16: # make sure the entity is in the right section
-                block_info = layers[int(entity['Pos'][1]) & 15][int(entity['Pos'][2]) & 15][int(entity['Pos'][0]) & 15]
-                if 'entities' not in block_info:
-                    block_info['entities'] = []
-                block_info['entities'].append(entity)
+            entity_x, entity_y, entity_z = entity_block(entity)
+            if y * 16 <= entity_y < y * 16 + 16: # make sure the entity is in the right section
+                block_info_dict = layers[entity_y & 15][entity_z & 15][entity_x & 15]
+                if 'entities' not in block_info_dict:
+                    block_info_dict['entities'] = []
+                block_info_dict['entities'].append(entity)
     if 'TileEntities' in column['Level']:
         for tile_entity in column['Level']['TileEntities']:
             if y * 16 <= tile_entity['y'] < y * 16 + 16: # make sure the entity is in the right section
-                block_info = layers[tile_entity['y'] & 15][tile_entity['z'] & 15][tile_entity['x'] & 15]
-                del tile_entity['x']
-                del tile_entity['y']
-                del tile_entity['z']
-                if 'tileEntities' in block_info:
-                    block_info['tileEntities'].append(tile_entity)
-                elif 'tileEntity' in block_info:
-                    block_info['tileEntities'] = [block_info['tileEntity'], tile_entity]
-                    del block_info['tileEntity']
-                else:
-                    block_info['tileEntity'] = tile_entity
+                add_tile_entity(layers[tile_entity['y'] & 15][tile_entity['z'] & 15][tile_entity['x'] & 15], tile_entity)
     return layers
 
+def chunk_section_binary(column, x, y, z):
+    """Returns the given chunk section in a compact binary format as a bytes object. All integers are big-endian.
+
+    Header (20 bytes): the magic number b'WMCS', the format version (unsigned byte, currently 1), a flags byte (1 if the section contains any blocks, 2 if the column has biome data, or both), the x, y, and z chunk coordinates of the section (signed 32-bit each), and the palette size (unsigned 16-bit, 0 if the section is empty).
+
+    If the column has biome data, 256 unsigned bytes with the numeric biome IDs follow, indexed by 16 * z + x.
+
+    If the section contains any blocks, the following fields come next:
+    palette -- For each palette entry, the numeric block ID (unsigned 16-bit) and damage value (unsigned byte).
+    blocks -- 4096 palette indices, indexed by 256 * y + 16 * z + x. Each index is an unsigned byte if the palette has at most 256 entries, and unsigned 16-bit otherwise.
+    block light -- 2048 bytes with two 4-bit values each, indexed like the blocks. The lower 4 bits of each byte come first.
+    sky light -- 2048 bytes, in the same format as the block light.
+
+    Entities and tile entities are not included.
+    """
+    for section in column['Level']['Sections']:
+        if section['Y'] == y:
+            break
+    else:
+        section = None
+    flags = 0
+    body = bytearray()
+    palette = collections.OrderedDict()
+    if 'Biomes' in column['Level']:
+        flags |= 2
+        body += bytes(biome & 255 for biome in column['Level']['Biomes'])
+    if section is not None:
+        flags |= 1
+        indices = []
+        for block_index, block_id in enumerate(section['Blocks']):
+            if 'Add' in section:
+                block_id += nybble(section['Add'], block_index) << 8
+            indices.append(palette.setdefault((block_id, nybble(section['Data'], block_index)), len(palette)))
+        for block_id, damage in palette:
+            body += struct.pack('>HB', block_id, damage)
+        body += struct.pack('>4096{}'.format('B' if len(palette) <= 256 else 'H'), *indices)
+        body += bytes(section['BlockLight'])
+        body += bytes(section['SkyLight'])
+    return struct.pack('>4sBBiiiH', b'WMCS', 1, flags, x, y, z, len(palette)) + bytes(body)
+
+def column_blocks_info(column, coords, *, biomes, blocks):
+    """Yields the info about each of the given blocks in a chunk column, in the format used by chunk_section_info.
+
+    Required arguments:
+    column -- A dict representing the NBT data of the chunk column
+    coords -- An iterable of absolute (x, y, z) block coordinates, all of which must be inside the column
+
+    Keyword-only arguments:
+    biomes -- A dict as returned by biome_names
+    blocks -- A dict as returned by block_names
+    """
+    sections = {section['Y']: section for section in column['Level']['Sections']}
+    result = collections.OrderedDict(((x, y, z), block_info(column, sections.get(y // 16), x, y, z, biomes=biomes, blocks=blocks)) for x, y, z in coords)
+    for entity in column['Level'].get('Entities', []):
+        block_info_dict = result.get(entity_block(entity))
+        if block_info_dict is not None:
+            if 'entities' not in block_info_dict:
+                block_info_dict['entities'] = []
+            block_info_dict['entities'].append(entity)
+    for tile_entity in column['Level'].get('TileEntities', []):
+        block_info_dict = result.get((tile_entity['x'], tile_entity['y'], tile_entity['z']))
+        if block_info_dict is not None:
+            add_tile_entity(block_info_dict, tile_entity)
+    yield from result.values()
+
 def normalize_advancements(player_advancements):
     result = copy.deepcopy(player_advancements)
     for advancement_name, advancement in player_advancements.items():
@@ -307,99 +563,856 @@ def normalize_advancements(player_advancements):
             result[advancement_name]['criteria'][criterion_name] = '{:%Y-%m-%d %H:%M:%S %z}'.format(timestamp)
     return result
 
-def cached_image(cache_path, image_func, cache_check):
-    if api.util.CONFIG['cache'].exists():
-        image_path = api.util.CONFIG['cache'] / cache_path
-        if cache_check(image_path):
-            return bottle.static_file(image_path.name, str(image_path.parent), mimetype='image/png')
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    """Opens a temporary file next to path and moves it into place when the with block exits normally, so readers never see a partially written file. On error, the temporary file is removed and path is left untouched."""
+    path = pathlib.Path(path)
+    os.makedirs(str(path.parent), exist_ok=True)
+    temp_file = tempfile.NamedTemporaryFile(mode=mode, dir=str(path.parent), prefix='.{}.'.format(path.name), suffix='.tmp', delete=False)
+    try:
+        with temp_file:
+            yield temp_file
+        os.replace(temp_file.name, str(path))
+    except:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(temp_file.name)
+        raise
+
+@functools.lru_cache(maxsize=4096)
+def _file_digest(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_digest(path):
+    """Returns the SHA-256 hex digest of a file's contents. Digests are memoized as long as the file's size and modification time stay the same."""
+    stat = os.stat(str(path))
+    return _file_digest(str(path), stat.st_size, stat.st_mtime_ns)
+
+TEXTURES = LRUCache(128) # (path, file digest): decoded PIL.Image.Image in RGBA mode
+
+def texture(path):
+    """Returns the image file at path as a PIL.Image.Image in RGBA mode. Decoded images are kept in memory until the file changes. Callers must not modify the returned image."""
+    import PIL.Image
+
+    key = str(path), file_digest(path)
+    image = TEXTURES.get(key)
+    if image is None:
+        image = TEXTURES[key] = PIL.Image.open(str(path)).convert('RGBA')
+    return image
+
+MAP_RENDERS = LRUCache(512) # (path, mtime in nanoseconds): PIL.Image.Image
+
+def map_render(map_path):
+    """Returns the rendered map item stored in the given map_<id>.dat file, as returned by api.util.map_image. Renders are kept in memory until the file is modified. Callers must not modify the returned image."""
+    key = str(map_path), os.stat(str(map_path)).st_mtime_ns
+    image = MAP_RENDERS.get(key)
+    if image is None:
+        image = MAP_RENDERS[key] = api.util.map_image(nbtfile_to_dict(map_path))
+    return image
+
+MAP_WALL_FLIGHTS = SingleFlight()
+
+def _update_map_wall(image_path, map_paths, cols):
+    import PIL.Image
+    import PIL.PngImagePlugin
+
+    mtimes = [None if map_path is None or not map_path.exists() else map_path.stat().st_mtime_ns for map_path in map_paths]
+    try:
+        image = PIL.Image.open(str(image_path))
+        image.load()
+        old_mtimes = json.loads(image.text['mtimes'])
+        old_size = image_path.stat().st_size
+    except (OSError, KeyError, ValueError):
+        image = None
+        old_size = 0
+    if image is not None and mtimes == old_mtimes:
+        disk_cache_hit(image_path)
+        return
+    if image is None:
+        image = PIL.Image.new('RGBA', (cols * 128, math.ceil(len(map_paths) / cols) * 128), color=(0, 0, 0, 0))
+        old_mtimes = [False] * len(map_paths) # redraw everything, including gaps
+    for i, (map_path, mtime, old_mtime) in enumerate(zip(map_paths, mtimes, old_mtimes)):
+        if mtime == old_mtime:
+            continue
+        y, x = divmod(i, cols)
+        if mtime is None:
+            image.paste((0, 0, 0, 0), (x * 128, y * 128, x * 128 + 128, y * 128 + 128))
         else:
-            if not image_path.parent.exists():
-                image_path.parent.mkdir(parents=True)
-            image_file = image_path.open('wb')
-    else:
-        image_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
+            image.paste(map_render(map_path), (x * 128, y * 128))
+    png_info = PIL.PngImagePlugin.PngInfo()
+    png_info.add_text('mtimes', json.dumps(mtimes)) # stored in the image itself so the image and the mtimes it was drawn from are always replaced together
+    with atomic_write(image_path, 'wb') as image_f:
+        image.save(image_f, 'PNG', pnginfo=png_info)
+    image_cache_add(image_path.stat().st_size - old_size)
+
+def map_wall(map_paths, cols):
+    """Returns the path to a PNG image of several map items arranged in a grid.
+
+    Required arguments:
+    map_paths -- A list of paths to map_<id>.dat files in row-major order. None or a missing file leaves a gap.
+    cols -- The number of columns.
+
+    Walls are cached and only the maps whose files changed are redrawn. Concurrent updates of the same wall are coalesced. Walls are kept in the image cache, see image_cache_path.
+    """
+    wall_hash = hashlib.sha256(json.dumps([[None if map_path is None else str(map_path) for map_path in map_paths], cols]).encode('utf-8')).hexdigest()
+    image_path = image_cache_path('map-walls', '{}.png'.format(wall_hash))
+    MAP_WALL_FLIGHTS(wall_hash, _update_map_wall, image_path, map_paths, cols)
+    return image_path
+
+DISK_CACHE_LOCK = threading.Lock()
+_disk_cache_sizes = {} # name of a subdirectory of the cache: total size of the files in it in bytes as known to this process
+
+def _disk_cache_files(name):
+    for dirpath, dirnames, filenames in os.walk(str(api.util.CONFIG['cache'] / name)):
+        for filename in filenames:
+            if not filename.startswith('.'): # skip temporary files from atomic_write
+                path = os.path.join(dirpath, filename)
+                with contextlib.suppress(FileNotFoundError):
+                    yield path, os.stat(path)
+
+def disk_cache_add(name, num_bytes, max_size):
+    """Records a change in the total size of a subdirectory of the cache, evicting the least recently used files if it exceeds max_size bytes. Files are ordered by access time, see disk_cache_hit."""
+    with DISK_CACHE_LOCK:
+        if name not in _disk_cache_sizes:
+            _disk_cache_sizes[name] = sum(stat.st_size for _, stat in _disk_cache_files(name))
+        else:
+            _disk_cache_sizes[name] += num_bytes
+        if _disk_cache_sizes[name] <= max_size:
+            return
+        # remeasure, then evict down to 90% of the limit so eviction doesn't run on every write
+        files = sorted(_disk_cache_files(name), key=lambda path_stat: path_stat[1].st_atime)
+        _disk_cache_sizes[name] = sum(stat.st_size for _, stat in files)
+        for path, stat in files:
+            if _disk_cache_sizes[name] <= max_size * 0.9:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            _disk_cache_sizes[name] -= stat.st_size
+
+def disk_cache_hit(path):
+    """Marks a file in a subdirectory of the cache as recently used, so it is evicted last by disk_cache_add. Its modification time is kept."""
+    with contextlib.suppress(FileNotFoundError):
+        os.utime(str(path), (time.time(), os.stat(str(path)).st_mtime))
+
+def image_cache_path(*parts):
+    """Returns a path in the image cache, the subdirectory of the cache holding all rendered images: those of cached_image, skin renders, and map walls. They share a single limit, the imageCacheSize config value in bytes, see image_cache_add."""
+    return api.util.CONFIG['cache'] / 'images' / pathlib.Path(*parts)
+
+def image_cache_add(num_bytes):
+    """Records a change in the total size of the image cache, evicting the least recently used images if it grows beyond the imageCacheSize config value in bytes."""
+    disk_cache_add('images', num_bytes, api.util.CONFIG['imageCacheSize'])
+
+def cached_image(cache_key, image_func, *, max_age=None):
+    """Returns a PNG image response, rendering the image only if it is not in the image cache.
+
+    Required arguments:
+    cache_key -- A JSON-serializable value identifying all inputs of the render, e.g. the kind of image, render parameters, and digests of source files as returned by file_digest. Images are cached under the SHA-256 hash of this value.
+    image_func -- A function without arguments that renders the image as a PIL.Image.Image.
+
+    Keyword-only arguments:
+    max_age -- A datetime.timedelta. If given, cached images older than this are rendered again. Used for images whose sources can't be hashed, like skins from the Mojang API.
+
+    Images are written atomically, and kept in the image cache, see image_cache_path.
+    """
+    if not api.util.CONFIG['cache'].exists():
+        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as image_file:
+            image_func().save(image_file, 'PNG')
         image_path = pathlib.Path(image_file.name)
+        return bottle.static_file(image_path.name, str(image_path.parent), mimetype='image/png')
+    key_hash = hashlib.sha256(json.dumps(cache_key, sort_keys=True).encode('utf-8')).hexdigest()
+    image_path = image_cache_path(key_hash[:2], '{}.png'.format(key_hash))
     try:
-        with image_file:
-            image = image_func()
+        old_stat = image_path.stat()
+    except FileNotFoundError:
+        old_stat = None
+    if old_stat is not None and (max_age is None or time.time() - old_stat.st_mtime < max_age.total_seconds()):
+        disk_cache_hit(image_path)
+    else:
+        image = image_func()
+        with atomic_write(image_path, 'wb') as image_file:
             image.save(image_file, 'PNG')
-    except:
-        if image_path.exists():
-            image_path.unlink() # clean up empty image file
-        raise
+        image_cache_add(image_path.stat().st_size - (0 if old_stat is None else old_stat.st_size))
     return bottle.static_file(image_path.name, str(image_path.parent), mimetype='image/png')
 
-def skin_cache_check(image_path):
-    if not image_path.exists():
-        return False # image has not been rendered yet
-    max_age = datetime.timedelta(hours=random.randrange(4, 8), minutes=random.randrange(0, 60)) # use a random value between 4 and 8 hours for the cache expiration check
-    if datetime.datetime.utcfromtimestamp(image_path.stat().st_mtime) < datetime.datetime.utcnow() - max_age:
-        return False # image is older than max_age
-    return True
+def skin_max_age():
+    """Returns the max_age for cached skin renders: a random value between 4 and 8 hours, so that not all renders expire at once."""
+    return datetime.timedelta(hours=random.randrange(4, 8), minutes=random.randrange(0, 60))
+
+SKIN_TEXTURE_KEYS = LRUCache(1024) # player UUID: (texture key, expiration timestamp)
+SKIN_RENDERS = LRUCache(256) # (render kind, texture key): full-size PIL.Image.Image
+SKIN_FLIGHTS = SingleFlight()
+
+def _fetch_skin_texture_key(player):
+    key_path = api.util.CONFIG['cache'] / 'skins' / 'textures' / '{}.json'.format(player.uuid)
+    try:
+        with key_path.open() as key_f:
+            texture_key = json.load(key_f)
+        expires = key_path.stat().st_mtime + skin_max_age().total_seconds()
+    except (OSError, ValueError):
+        texture_key = None
+        expires = 0
+    if expires <= time.time():
+        try:
+            profile = requests.get('https://sessionserver.mojang.com/session/minecraft/profile/{}'.format(player.uuid.hex), timeout=10).json()
+            textures = json.loads(base64.b64decode(more_itertools.first(prop['value'] for prop in profile['properties'] if prop['name'] == 'textures')).decode('utf-8'))
+        except Exception:
+            if texture_key is None:
+                raise
+            # keep using the old skin when the Mojang API is unavailable or rate limited, and retry in a minute
+            expires = time.time() + 60
+        else:
+            if 'SKIN' in textures.get('textures', {}):
+                texture_key = textures['textures']['SKIN']['url'].split('/')[-1]
+            else:
+                texture_key = 'default-{}'.format(player.uuid) # default skins depend on the UUID
+            if api.util.CONFIG['cache'].exists():
+                with atomic_write(key_path) as key_f:
+                    json.dump(texture_key, key_f)
+            expires = time.time() + skin_max_age().total_seconds()
+    SKIN_TEXTURE_KEYS[player.uuid] = texture_key, expires
+    return texture_key
+
+def skin_texture_key(player):
+    """Returns a string identifying the player's current skin: the hash of the skin texture, or a UUID-specific key for default skins. Lookups are cached for 4 to 8 hours, in memory and on disk."""
+    texture_key, expires = SKIN_TEXTURE_KEYS.get(player.uuid, (None, 0))
+    if expires > time.time():
+        return texture_key
+    return SKIN_FLIGHTS(('texture', player.uuid), _fetch_skin_texture_key, player)
+
+def _render_skin(player, kind, texture_key):
+    import PIL.Image
+    import playerhead
+
+    render_path = image_cache_path('skins', kind, '{}.png'.format(texture_key))
+    try:
+        image = PIL.Image.open(str(render_path))
+        image.load()
+    except OSError:
+        render_func = {'body': playerhead.body, 'head': playerhead.head}[kind]
+        image = render_func(player.data['minecraft']['nicks'][-1], profile_id=player.uuid)
+        if api.util.CONFIG['cache'].exists():
+            old_size = render_path.stat().st_size if render_path.exists() else 0 # e.g. a corrupt render
+            with atomic_write(render_path, 'wb') as render_f:
+                image.save(render_f, 'PNG')
+            image_cache_add(render_path.stat().st_size - old_size)
+    else:
+        disk_cache_hit(render_path)
+    SKIN_RENDERS[kind, texture_key] = image
+    return image
+
+def skin_render(player, kind, texture_key=None):
+    """Returns the full-size render of a player's skin as a PIL.Image.Image, to be resized by the caller.
+
+    Required arguments:
+    player -- an api.util2.Player
+    kind -- 'head' or 'body'
+
+    Optional arguments:
+    texture_key -- the result of skin_texture_key(player), if already known
+
+    Renders are done once per skin using playerhead, and kept in memory and in the image cache (see image_cache_path). Concurrent renders of the same skin are coalesced.
+    """
+    if texture_key is None:
+        texture_key = skin_texture_key(player)
+    image = SKIN_RENDERS.get((kind, texture_key))
+    if image is None:
+        image = SKIN_FLIGHTS(('render', kind, texture_key), _render_skin, player, kind, texture_key)
+    return image
+
+HEAD_ATLAS_LAYOUTS = LRUCache(16) # (head size, people database version, player data file names): (number of columns, list of (player, offset) pairs)
+
+def head_atlas_layout(size):
+    """Returns the number of columns and a list of (player, offset) pairs for the player head atlas with the given head size. Players are sorted by ID, and players without a Minecraft account are skipped.
+
+    The layout doesn't depend on skin lookups, so atlas.json and atlas.png agree even if some skins can't be looked up. It is cached until the people database or the set of player data files changes. Callers must not modify the returned offsets.
+    """
+    player_files = sorted(
+        player_path.name
+        for world in minecraft.worlds()
+        if (world.world_path / 'playerdata').exists()
+        for player_path in (world.world_path / 'playerdata').iterdir()
+        if player_path.suffix == '.dat'
+    )
+    key = size, people_version(), tuple(player_files)
+    layout = HEAD_ATLAS_LAYOUTS.get(key)
+    if layout is None:
+        players = [player for player in sorted(Player.all(), key=str) if player.uuid is not None]
+        columns = max(1, math.ceil(math.sqrt(len(players))))
+        layout = HEAD_ATLAS_LAYOUTS[key] = columns, [(player, {'x': size * (i % columns), 'y': size * (i // columns)}) for i, player in enumerate(players)]
+    return layout
+
+DECODED_OBJECT_MAX_AGE = 60 # seconds that World and Player objects decoded from URL arguments are reused across requests
+WORLDS = LRUCache(64) # world name: (minecraft.World, expiration time)
+PLAYERS = LRUCache(1024) # player ID as given: (Player, expiration time)
+PEOPLE_VERSIONS = LRUCache(1) # None: (version key of the people database, expiration time)
+
+def _reuse(cache, key, func):
+    cached = cache.get(key)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    value = func()
+    cache[key] = value, time.monotonic() + DECODED_OBJECT_MAX_AGE
+    return value
+
+def world_by_name(name):
+    """Returns minecraft.World(name). The object is created once per memo scope, and reused for up to DECODED_OBJECT_MAX_AGE seconds across requests. Each call returns a (shallow) copy, so setting attributes doesn't affect other requests."""
+    return copy.copy(memoized(('world', name), lambda: _reuse(WORLDS, name, lambda: minecraft.World(name))))
+
+def player_by_id(player_id):
+    """Returns Player(player_id). The people database and Mojang API lookups are done once per memo scope, and reused for up to DECODED_OBJECT_MAX_AGE seconds across requests, so changes to the people database may take that long to show up. Each call returns a deep copy, so callers may modify the player's data."""
+    return copy.deepcopy(memoized(('player', player_id), lambda: _reuse(PLAYERS, player_id, lambda: Player(player_id))))
+
+def people_version():
+    """Returns a string which changes whenever the people database changes, or None if the people module is not installed. Like player_by_id, the result is shared within a memo scope and reused for up to DECODED_OBJECT_MAX_AGE seconds across requests."""
+    def version():
+        try:
+            import people
+        except ImportError:
+            return None
+        return hashlib.sha1(json.dumps(people.get_people_db().obj_dump(version=3), sort_keys=True).encode('utf-8')).hexdigest() # not people_dump, which is memoized by version
+
+    return memoized(('people-version',), lambda: _reuse(PEOPLE_VERSIONS, None, version))
+
+NICK_PLAYER_IDS = LRUCache(1) # people database version: dict mapping Minecraft nicks to the Wurstmineberg IDs of the only people who used them
+MOJANG_NICK_PLAYERS = LRUCache(1024) # (Minecraft nick, date): Player
+
+def player_by_minecraft_nick(nick, at=None):
+    """Returns the player who used the Minecraft nick at the given datetime (or currently, if at is None).
+
+    Nicks which only one person in the people database has used are resolved with player_by_id, without asking the Mojang API. This makes log lines cheap to parse even without the "UUID of player" line before them, e.g. when resuming from a cursor. Other nicks are looked up with Player.by_minecraft_nick, and the results are cached per day. Raises LookupError if the nick can't be resolved.
+    """
+    version = people_version()
+    nick_player_ids = NICK_PLAYER_IDS.get(version)
+    if nick_player_ids is None:
+        nick_player_ids = {}
+        if version is not None:
+            ambiguous = set()
+            for wurstmineberg_id, person_data in people_dump()['people'].items():
+                for person_nick in set(person_data.get('minecraft', {}).get('nicks', [])):
+                    if person_nick in nick_player_ids:
+                        ambiguous.add(person_nick)
+                    nick_player_ids[person_nick] = wurstmineberg_id
+            for person_nick in ambiguous:
+                del nick_player_ids[person_nick]
+        NICK_PLAYER_IDS[version] = nick_player_ids
+    if nick in nick_player_ids:
+        return player_by_id(nick_player_ids[nick])
+    key = nick, None if at is None else at.date()
+    player = MOJANG_NICK_PLAYERS.get(key)
+    if player is None:
+        player = MOJANG_NICK_PLAYERS[key] = Player.by_minecraft_nick(nick, at=at)
+    return copy.deepcopy(player)
+
+UUID_PLAYER_IDS = LRUCache(1) # people database version: dict mapping Minecraft UUIDs to Wurstmineberg IDs
+
+def player_id_by_uuid(player_uuid):
+    """Returns the ID of the player with the given Minecraft UUID (as a string) as used in API results: the Wurstmineberg ID if the people database has one, otherwise the UUID in canonical form. Unlike str(Player(player_uuid)), this never needs the Mojang API. Strings that aren't UUIDs are returned unchanged."""
+    try:
+        player_uuid = str(uuid.UUID(player_uuid))
+    except ValueError:
+        return player_uuid
+    version = people_version()
+    uuid_player_ids = UUID_PLAYER_IDS.get(version)
+    if uuid_player_ids is None:
+        uuid_player_ids = {}
+        if version is not None:
+            for wurstmineberg_id, person_data in people_dump()['people'].items():
+                with contextlib.suppress(KeyError, ValueError):
+                    uuid_player_ids[str(uuid.UUID(person_data['minecraft']['uuid']))] = wurstmineberg_id
+        UUID_PLAYER_IDS[version] = uuid_player_ids
+    return uuid_player_ids.get(player_uuid, player_uuid)
+
+def _decode_dimension(arg):
+    try:
+        int(arg)
+    except:
+        return Dimension[arg]
+    else:
+        return Dimension(int(arg))
+
+def _decode_color(arg):
+    return int(arg[:2], 16), int(arg[2:4], 16), int(arg[4:6], 16)
+
+def _arg_decoder(param):
+    # returns a function that decodes a string argument for the parameter, or None if it is passed as is
+    if param.kind is not inspect.Parameter.POSITIONAL_OR_KEYWORD:
+        raise ValueError('The decode_args function only works for POSITIONAL_OR_KEYWORD parameters, but a {} parameter was found'.format(param.kind))
+    if param.annotation is inspect.Parameter.empty:
+        return None
+    elif param.annotation is Dimension:
+        return _decode_dimension
+    elif param.annotation is Player:
+        return player_by_id
+    elif param.annotation is int:
+        return int
+    elif param.annotation is minecraft.World:
+        return world_by_name
+    elif param.annotation == 'color':
+        return _decode_color
+    elif isinstance(param.annotation, range):
+        def decode_range(arg):
+            if int(arg) not in param.annotation:
+                bottle.abort(403, 'Parameter {} must be in {}'.format(param.name, param.annotation))
+            return int(arg)
+
+        return decode_range
+    else:
+        raise TypeError('The decode_args function is not implemented for the argument type {!r}'.format(param.annotation))
 
 def decode_args(f):
+    signature = inspect.signature(f)
+    names = list(signature.parameters)
+    decoders = [(param.name, _arg_decoder(param)) for param in signature.parameters.values()] # compiled once here rather than on every call
+
+    def decode(*args, **kwargs):
+        for name, arg in zip(names, args):
+            if name not in kwargs:
+                kwargs[name] = arg
+        decoded_args = {}
+        for name, decoder in decoders:
+            if name not in kwargs: # partial decoding, see decorated.decode below
+                continue
+            arg = kwargs[name]
+            if decoder is None or not isinstance(arg, str): # no annotation or a direct function call
+                decoded_args[name] = arg
+            else:
+                decoded_args[name] = decoder(arg)
+        return decoded_args
+
     @functools.wraps(f)
     def decorated(*args, **kwargs):
-        for param, arg in zip(inspect.signature(f).parameters.values(), args):
-            if param.name not in kwargs:
-                kwargs[param.name] = arg
-        decoded_args = {}
-        for param in inspect.signature(f).parameters.values():
-            arg = kwargs[param.name]
-            if param.kind is not inspect.Parameter.POSITIONAL_OR_KEYWORD:
-                raise ValueError('The decode_args function only works for POSITIONAL_OR_KEYWORD parameters, but a {} parameter was found'.format(param.kind))
-            if param.annotation is inspect.Parameter.empty or not isinstance(arg, str): # no annotation or a direct function call
-                decoded_args[param.name] = arg
-            elif param.annotation is Dimension:
+        return f(**decode(*args, **kwargs))
+
+    decorated.decode = decode # decodes the given arguments without calling the function, used by json_route
+    return decorated
+
+def source_versions(sources):
+    """Returns a version key and the last modification time (or None) for a list of sources, as returned by the sources functions of json_route.
+
+    Each source can be a pathlib.Path to a file or a directory, or any other JSON-serializable value used as a version key as is. Directories are not searched recursively, but the modification times of the files directly inside them are included.
+    """
+    version = []
+    last_modified = None
+    for source in sources:
+        if isinstance(source, pathlib.Path):
+            paths = [source]
+            with contextlib.suppress(OSError):
+                if source.is_dir():
+                    paths += sorted(source.iterdir())
+            for path in paths:
                 try:
-                    int(arg)
-                except:
-                    decoded_args[param.name] = Dimension[arg]
+                    stat = path.stat()
+                except FileNotFoundError:
+                    version.append([str(path), None])
                 else:
-                    decoded_args[param.name] = Dimension(int(arg))
-            elif param.annotation is Player:
-                decoded_args[param.name] = Player(arg)
-            elif param.annotation is int:
-                decoded_args[param.name] = int(arg)
-            elif param.annotation is minecraft.World:
-                decoded_args[param.name] = minecraft.World(arg)
-            elif param.annotation == 'color':
-                decoded_args[param.name] = (int(arg[:2], 16), int(arg[2:4], 16), int(arg[4:6], 16))
-            elif isinstance(param.annotation, range):
-                if int(arg) not in param.annotation:
-                    bottle.abort(403, 'Parameter {} must be in {}'.format(param.name, param.annotation))
-                decoded_args[param.name] = int(arg)
-            else:
-                raise TypeError('The decode_args function is not implemented for the argument type {:?}'.format(param.annotation))
-        return f(**decoded_args)
+                    version.append([str(path), stat.st_mtime_ns, stat.st_size])
+                    if last_modified is None or stat.st_mtime > last_modified:
+                        last_modified = stat.st_mtime
+        else:
+            version.append(source)
+    return version, last_modified
 
-    return decorated
+def check_not_modified(version, last_modified=None):
+    """Sets the ETag and Last-Modified headers of the current response, and raises a 304 Not Modified response if the client's cached copy is still valid. Otherwise, returns the ETag.
+
+    Required arguments:
+    version -- A JSON-serializable value that changes whenever the response changes, e.g. from source_versions. The request URL and the negotiated JSON format are included automatically.
+
+    Optional arguments:
+    last_modified -- The last modification time of the response's sources, as a UNIX timestamp.
+    """
+    etag = 'W/"{}"'.format(hashlib.sha1(json.dumps([bottle.request.path, bottle.request.query_string, json_pretty_requested(), version], sort_keys=True).encode('utf-8')).hexdigest())
+    headers = {
+        'ETag': etag,
+        'Vary': 'Accept, Accept-Encoding' # also on 304 responses, so caches don't serve one encoding's validators for another, see encoded_response
+    }
+    if last_modified is not None:
+        headers['Last-Modified'] = email.utils.formatdate(last_modified, usegmt=True)
+    for header, value in headers.items():
+        bottle.response.set_header(header, value)
+    if_none_match = bottle.request.get_header('If-None-Match')
+    if if_none_match is not None:
+        not_modified = if_none_match.strip() == '*' or etag in (tag.strip() for tag in if_none_match.split(','))
+    elif last_modified is not None and bottle.request.get_header('If-Modified-Since') is not None:
+        if_modified_since = bottle.parse_date(bottle.request.get_header('If-Modified-Since').split(';')[0].strip())
+        not_modified = if_modified_since is not None and int(last_modified) <= if_modified_since
+    else:
+        not_modified = False
+    if not_modified:
+        raise bottle.HTTPResponse(status=304, headers=headers)
+    return etag
+
+def json_pretty_requested():
+    """Returns whether the current request should get indented JSON with sorted keys, which is the default. Clients get compact JSON by passing ?pretty=0, or by sending an Accept header that includes application/json but not text/html."""
+    try:
+        pretty = bottle.request.query.get('pretty')
+        accept = bottle.request.get_header('Accept', '')
+    except RuntimeError: # called outside of a request
+        return True
+    if pretty is not None:
+        return pretty.lower() not in ('0', 'false', 'no')
+    return 'application/json' not in accept or 'text/html' in accept
+
+def json_dumps(value, *, pretty=True):
+    """Encodes a value as a JSON string.
+
+    Keyword-only arguments:
+    pretty -- If true (the default), the JSON is indented by 4 spaces and object keys are sorted. Otherwise, it is compact and keys keep their order, and orjson or ujson is used if installed.
+    """
+    if pretty:
+        return json.dumps(value, sort_keys=True, indent=4)
+    if orjson is not None:
+        with contextlib.suppress(TypeError): # e.g. integers too large for orjson
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    elif ujson is not None:
+        with contextlib.suppress(OverflowError, TypeError):
+            return ujson.dumps(value, ensure_ascii=False, escape_forward_slashes=False)
+    return json.dumps(value, separators=(',', ':'))
+
+PRETTY_JSON_ENCODER = json.JSONEncoder(sort_keys=True, indent=4)
+
+def json_iterencode(value, *, pretty=True, level=0):
+    """Yields the JSON encoding of a value in chunks.
+
+    Keyword-only arguments:
+    pretty -- Whether to produce indented JSON with sorted keys, as in json_dumps.
+    level -- The nesting level at which the value appears in the surrounding JSON document, for indentation in pretty mode.
+    """
+    if pretty:
+        indent = '\n' + ' ' * 4 * level
+        for chunk in PRETTY_JSON_ENCODER.iterencode(value):
+            yield chunk.replace('\n', indent) # newlines only appear as whitespace since they are escaped in strings
+    else:
+        yield json_dumps(value, pretty=False)
+
+def json_stream(items, *, object_pairs=False, pretty=True):
+    """Yields the JSON encoding of a JSON array containing the given items, or of a JSON object built from (key, value) pairs if object_pairs is true, encoding one item at a time."""
+    start, end = ('{', '}') if object_pairs else ('[', ']')
+    empty = True
+    for item in items:
+        if empty:
+            yield start
+            empty = False
+        else:
+            yield ','
+        if pretty:
+            yield '\n    '
+        if object_pairs:
+            key, item = item
+            yield json.dumps(str(key))
+            yield ': ' if pretty else ':'
+        yield from json_iterencode(item, pretty=pretty, level=1)
+    if empty:
+        yield start + end + '\n'
+    elif pretty:
+        yield '\n' + end + '\n'
+    else:
+        yield end + '\n'
+
+def buffered(chunks, size=65536, *, max_delay=None):
+    """Joins an iterable of small strings into chunks of about the given size, to avoid writing many tiny pieces to the client.
+
+    Keyword-only arguments:
+    max_delay -- If given, a chunk is also yielded when a string arrives at least this many seconds after the previous chunk, so that slowly produced output still reaches the client regularly.
+    """
+    buf = []
+    buf_len = 0
+    last_yield = time.monotonic()
+    for chunk in chunks:
+        buf.append(chunk)
+        buf_len += len(chunk)
+        if buf_len >= size or (max_delay is not None and time.monotonic() - last_yield >= max_delay):
+            yield ''.join(buf)
+            buf = []
+            buf_len = 0
+            last_yield = time.monotonic()
+    if len(buf) > 0:
+        yield ''.join(buf)
+
+COMPRESSION_LEVELS = {
+    'br': 5, # brotli quality, 11 is too slow for compressing responses on the fly
+    'gzip': 6
+}
+
+def negotiate_encoding():
+    """Returns the content coding for the current response according to the request's Accept-Encoding header: 'br' if the brotli module is installed and the client accepts it, 'gzip' if the client accepts it, or None for an uncompressed response."""
+    try:
+        accept_encoding = bottle.request.get_header('Accept-Encoding', '')
+    except RuntimeError: # called outside of a request
+        return None
+    qvalues = {}
+    for coding in accept_encoding.split(','):
+        coding, _, params = coding.partition(';')
+        match = re.fullmatch(' *q *= *([0-9.]+) *', params)
+        try:
+            qvalues[coding.strip().lower()] = float(match.group(1)) if match else 1.0
+        except ValueError:
+            continue
+    available = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best = None
+    for coding in available: # in order of preference, for equal qvalues
+        qvalue = qvalues.get(coding, qvalues.get('*', 0.0))
+        if qvalue > 0 and (best is None or qvalue > best[1]):
+            best = coding, qvalue
+    if best is not None:
+        return best[0]
+
+def compressed(chunks, encoding):
+    """Compresses an iterable of strings or bytes with the given content coding, as returned by negotiate_encoding. Each input chunk is flushed, so a streamed response reaches the client incrementally."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESSION_LEVELS['br'])
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(COMPRESSION_LEVELS['gzip'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    else:
+        raise ValueError('Unsupported content coding: {!r}'.format(encoding))
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compress(chunk) + flush()
+        if len(data) > 0:
+            yield data
+    yield finish()
+
+RESPONSE_CACHE_MAX_ENTRY = 1 / 16 # largest share of the responseCacheSize config value that a single cached response may take up
+
+class _ResponseTooLarge(Exception):
+    pass
+
+def encoded_response(chunks, *, etag=None, cache=True):
+    """Sends an iterable of strings as the body of the current response, compressed if the client accepts it.
+
+    Keyword-only arguments:
+    etag -- The ETag of the response, as returned by check_not_modified. If given, the compressed response is stored in the response cache, and later requests for the same ETag are served from there without iterating over chunks at all. Chunks should be a generator in that case, so that nothing is computed on a cache hit.
+    cache -- If false, the response cache is not used even if etag is given.
+
+    Responses larger than RESPONSE_CACHE_MAX_ENTRY times the responseCacheSize are sent without being cached.
+    """
+    bottle.response.set_header('Vary', 'Accept, Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        yield from chunks
+        return
+    bottle.response.set_header('Content-Encoding', encoding)
+    if etag is None or not cache or not api.util.CONFIG['cache'].exists():
+        yield from compressed(chunks, encoding)
+        return
+    key_hash = hashlib.sha256(json.dumps([etag, encoding]).encode('utf-8')).hexdigest()
+    cache_path = api.util.CONFIG['cache'] / 'responses' / key_hash[:2] / '{}.{}'.format(key_hash, encoding)
+    try:
+        cache_f = cache_path.open('rb')
+    except FileNotFoundError:
+        pass
+    else:
+        with cache_f:
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(str(cache_path)) # mark as recently used for eviction
+            yield from iter(lambda: cache_f.read(65536), b'')
+        return
+    chunks = compressed(chunks, encoding)
+    max_size = api.util.CONFIG['responseCacheSize'] * RESPONSE_CACHE_MAX_ENTRY
+    size = 0
+    try:
+        with atomic_write(cache_path, 'wb') as cache_f:
+            for data in chunks:
+                size += len(data)
+                if size > max_size:
+                    raise _ResponseTooLarge(data) # discards the partially written cache file
+                cache_f.write(data)
+                yield data
+    except _ResponseTooLarge as e:
+        yield e.args[0]
+        yield from chunks
+        return
+    disk_cache_add('responses', cache_path.stat().st_size, api.util.CONFIG['responseCacheSize'])
+
+NDJSON_FLUSH_INTERVAL = 1 # seconds
+
+def ndjson_stream(items):
+    """Yields the newline-delimited JSON encoding of the given items: one compact JSON value per line."""
+    for item in items:
+        yield json_dumps(item, pretty=False) + '\n'
+
+ROUTE_RESULTS = LRUCache(256) # (function, arguments): (source version, last modification time, result), see json_route
+ROUTE_FLIGHTS = SingleFlight() # coalesces concurrent computations of the same result, see json_route
+
+PRECOMPUTE_INTERVAL = 10 # seconds between checks for changed sources of precomputed routes
+PRECOMPUTE_WORKERS = 2 # maximum number of results computed in the background at the same time
+
+_precomputed_routes = [] # (arguments function, refresh function) pairs registered by json_route
+_precomputer = None
+_precomputer_lock = threading.Lock()
+_background_work = True # see set_background_work
+
+def set_background_work(enabled):
+    """Sets whether this process may start the background threads which maintain state shared by all processes: the route precomputer and the tile entity indexer. The prefork server disables them in the master, so none are running when it forks, and enables them in only one of the workers, so the work isn't repeated by each of them."""
+    global _background_work
+
+    _background_work = enabled
+
+def background_work_enabled():
+    """Returns whether this process may start background threads which maintain shared state, see set_background_work."""
+    return _background_work
+
+def _run_precomputer(interval):
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=PRECOMPUTE_WORKERS)
+    pending = {} # (refresh function, arguments as JSON): future
+    while True:
+        for precompute, refresh in list(_precomputed_routes):
+            try:
+                arguments_list = list(precompute())
+            except Exception:
+                traceback.print_exc()
+                continue
+            for arguments in arguments_list:
+                key = refresh, json.dumps({name: str(value) for name, value in arguments.items()}, sort_keys=True)
+                if key in pending and not pending[key].done():
+                    continue # still computing the previous version
+                pending[key] = executor.submit(refresh, arguments)
+        for key, future in list(pending.items()):
+            if future.done():
+                del pending[key]
+                if future.exception() is not None:
+                    traceback.print_exception(type(future.exception()), future.exception(), future.exception().__traceback__)
+        time.sleep(interval)
+
+def start_precomputer(interval=PRECOMPUTE_INTERVAL):
+    """Starts the background thread that recomputes the results of routes registered with json_route(precompute=...) whenever their sources change, unless it is already running in this process or background work is disabled (see set_background_work)."""
+    global _precomputer
+
+    if not _background_work:
+        return
+    with _precomputer_lock:
+        if _precomputer is None or not _precomputer.is_alive(): # threads don't survive forking
+            _precomputer = threading.Thread(target=_run_precomputer, args=(interval,), name='route precomputer', daemon=True)
+            _precomputer.start()
+
+def precomputer_running():
+    """Returns whether the route precomputer is running in this process, so that the results it keeps warm are current."""
+    return _background_work and _precomputer is not None and _precomputer.is_alive()
+
+def json_route(app, route, method='GET', *, object_pairs=False, sources=None, precompute=None, streamed=None):
+    """Registers a function as a JSON endpoint.
+
+    The function may return any JSON-serializable value, or a generator, which is streamed as a JSON array of the generated values. Generator functions are also registered at route + '.ndjson', which streams the values as newline-delimited JSON instead. Pass streamed=True to do the same for a function which returns a generator, e.g. after validating its arguments. If object_pairs is true, the function must return a generator of (key, value) pairs instead, which is streamed as a JSON object. For Python callers, such a function returns a dict.
+
+    If sources is given, it is called with (decoded) arguments of the same names as the function's, or a subset of them, and returns a list of files, directories, and version keys that the response depends on (see source_versions). These are used to answer conditional requests with 304 Not Modified without calling the function. Compressed responses are also kept in the response cache, except for generators of array items, which are typically large. Results other than generators are also kept in memory until the sources change, for both HTTP requests and Python callers. Python callers get a deep copy of the kept result; the decorated function's shared attribute takes the same arguments and returns the kept result itself, for callers which don't modify it. Concurrent calls with the same arguments and source version wait for a single computation of the result. Generators, including those of (key, value) pairs, are potentially huge and recomputed on every call instead.
+
+    If precompute is given, sources must be given as well. It is called without arguments and returns an iterable of dicts of arguments for which the result should be kept warm. Once start_precomputer has been called, these results are recomputed in the background when their sources change, and while the precomputer is running in this process, HTTP requests are answered with the latest completed result (along with its ETag) instead of waiting for a new one. Other processes check the sources on every request as usual.
+    """
+    if precompute is not None and sources is None:
+        raise ValueError('json_route with precompute requires sources')
 
-def json_route(app, route):
     def decorator(f):
-        @app.route(route + '.json')
+        signature = inspect.signature(f)
+        if sources is not None:
+            source_names = list(inspect.signature(sources).parameters)
+
+        def call_arguments(args, kwargs):
+            arguments = signature.bind(*args, **kwargs).arguments
+            if hasattr(f, 'decode'):
+                return f.decode(**arguments)
+            return dict(arguments)
+
+        def source_version(arguments):
+            return source_versions(sources(**{name: arguments[name] for name in source_names}))
+
+        is_streamed = not object_pairs and (inspect.isgeneratorfunction(inspect.unwrap(f)) if streamed is None else streamed)
+
+        def result_key(arguments):
+            return f.__module__, f.__qualname__, json.dumps({name: str(value) for name, value in arguments.items()}, sort_keys=True)
+
+        def call(arguments, version=None, last_modified=None):
+            if sources is None or is_streamed or object_pairs:
+                return f(**arguments) # potentially huge results like logs or all players' stats are streamed, not kept in memory or shared
+            if version is None:
+                version, last_modified = source_version(arguments)
+            key = result_key(arguments)
+            cached = ROUTE_RESULTS.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[2]
+
+            def compute():
+                cached = ROUTE_RESULTS.get(key)
+                if cached is not None and cached[0] == version: # computed by a call that finished after our first check
+                    return cached[2]
+                result = f(**arguments)
+                ROUTE_RESULTS[key] = version, last_modified, result
+                return result
+
+            return ROUTE_FLIGHTS((key, json.dumps(version, sort_keys=True)), compute)
+
+        def respond(content_type, chunks, args, kwargs):
+            # the response is generated while it's streamed, after the request's memo has been removed (see end_request_memo), so it gets a memo scope of its own
+            memo = getattr(_memo_scopes, 'memo', None)
+
+            def response():
+                with memo_scope(memo):
+                    bottle.response.content_type = content_type
+                    arguments = call_arguments(args, kwargs)
+                    etag = version = last_modified = None
+                    if sources is not None:
+                        warm = ROUTE_RESULTS.get(result_key(arguments)) if precompute is not None and precomputer_running() else None # without a precomputer in this process, nothing would refresh the entry
+                        if warm is None:
+                            version, last_modified = source_version(arguments)
+                        else:
+                            version, last_modified, _ = warm # may be outdated until the precomputer catches up
+                        etag = check_not_modified(version, last_modified)
+                    yield from encoded_response(chunks(arguments, version, last_modified), etag=etag, cache=not is_streamed)
+
+            return response()
+
+        @app.route(route + '.json', method=method)
         @functools.wraps(f)
         def json_encoded(*args, **kwargs):
-            bottle.response.content_type = 'application/json'
-            result = f(*args, **kwargs)
-            if isinstance(result, types.GeneratorType):
-                empty = True
-                for value in result:
-                    if empty:
-                        yield '['
-                        empty = False
-                    else:
-                        yield ','
-                    yield '\n    '
-                    yield '\n    '.join(json.dumps(value, sort_keys=True, indent=4).split('\n'))
-                if empty:
-                    yield '[]\n'
-                else:
-                    yield '\n]\n'
+            return respond('application/json', json_chunks, args, kwargs)
+
+        def json_chunks(arguments, version, last_modified):
+            pretty = json_pretty_requested()
+            result = call(arguments, version, last_modified)
+            if object_pairs or isinstance(result, types.GeneratorType):
+                yield from buffered(json_stream(result, object_pairs=object_pairs, pretty=pretty))
             else:
-                yield json.dumps(result, sort_keys=True, indent=4)
+                yield json_dumps(result, pretty=pretty)
+
+        if is_streamed:
+            @app.route(route + '.ndjson', method=method)
+            @functools.wraps(f)
+            def ndjson_encoded(*args, **kwargs):
+                return respond('application/x-ndjson', ndjson_chunks, args, kwargs)
+
+            def ndjson_chunks(arguments, version, last_modified):
+                yield from buffered(ndjson_stream(call(arguments, version, last_modified)), max_delay=NDJSON_FLUSH_INTERVAL)
+
+        if precompute is not None:
+            def refresh(arguments):
+                with memo_scope():
+                    call(call_arguments((), arguments))
+
+            _precomputed_routes.append((precompute, refresh))
 
         pass #TODO add HTML view endpoint
+        if object_pairs:
+            @functools.wraps(f)
+            def as_dict(*args, **kwargs):
+                return dict(call(call_arguments(args, kwargs)))
+
+            return as_dict
+        if sources is not None and not is_streamed:
+            @functools.wraps(f)
+            def memoized(*args, **kwargs):
+                return copy.deepcopy(call(call_arguments(args, kwargs)))
+
+            @functools.wraps(f)
+            def shared(*args, **kwargs):
+                return call(call_arguments(args, kwargs))
+
+            memoized.shared = shared # make the kept result available for Python code which doesn't modify it
+            return memoized
         return f
 
     return decorator
@@ -426,11 +1439,21 @@ def nbt_route(app, route):
             else:
                 raise NotImplementedError('Cannot convert value of type {} to JSON'.format(type(result)))
 
+        def json_chunks(path):
+            yield json_dumps(nbtfile_to_dict(path), pretty=json_pretty_requested())
+
         @app.route(route + '.json')
         @functools.wraps(f)
         def json_encoded(*args, **kwargs):
             bottle.response.content_type = 'application/json'
-            return json.dumps(dict_encoded(*args, **kwargs), sort_keys=True, indent=4)
+            result = f(*args, **kwargs)
+            if isinstance(result, pathlib.Path):
+                etag = check_not_modified(*source_versions([result]))
+                return encoded_response(json_chunks(result), etag=etag)
+            elif isinstance(result, nbt.nbt.NBTFile):
+                return encoded_response([json_dumps(nbt_to_dict(result), pretty=json_pretty_requested())])
+            else:
+                raise NotImplementedError('Cannot convert value of type {} to JSON'.format(type(result)))
 
         @app.route(route + '.dat')
         @functools.wraps(f)
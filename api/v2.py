@@ -4,10 +4,14 @@ sys.path.append('/opt/py')
 
 import bottle
 import collections
-import contextlib
+import concurrent.futures
+import copy
 import datetime
 import hashlib
+import io
+import itertools
 import json
+import math
 import minecraft
 import more_itertools
 import pathlib
@@ -15,7 +19,12 @@ import re
 import subprocess
 import xml.sax.saxutils
 
+import api.aggregates
 import api.log
+import api.region
+import api.status
+import api.tile_entities
+import api.tiles
 import api.util
 import api.util2
 
@@ -30,6 +39,59 @@ DOCUMENTATION_INTRO = """
 
 application = api.util.Bottle()
 
+@application.hook('before_request')
+def start_request_memo():
+    api.util2.start_request_memo(bottle.request.environ.get('api.memo')) # set by api_batch to share the memo between sub-requests
+    api.util2.start_precomputer()
+    api.tile_entities.start_indexer()
+
+@application.hook('after_request')
+def end_request_memo():
+    api.util2.end_request_memo()
+
+MAX_BATCH_SIZE = 64
+BATCH_WORKERS = 8
+MAX_BULK_BLOCKS = 2 ** 18
+
+def player_files(directory, suffix):
+    """Returns a list of (player ID, path) pairs for the per-player files with the given suffix in a directory like stats or playerdata, sorted by player ID like the keys of other JSON objects."""
+    return sorted((str(api.util2.Player(path.stem)), path) for path in directory.iterdir() if path.suffix == suffix)
+
+def people_sources():
+    return [api.util2.people_version()] # player IDs in results are Wurstmineberg IDs where the people database knows them
+
+def log_sources(world):
+    return [world.path / 'server.log', world.path / 'logs'] + people_sources()
+
+def stats_sources(world):
+    return [world.world_path / 'stats'] + people_sources()
+
+def all_log_sources():
+    return [source for world in minecraft.worlds() for source in log_sources(world)]
+
+def each_world():
+    return [{'world': world} for world in minecraft.worlds()]
+
+def log_page_query():
+    """Returns the since, until, limit, and cursor query parameters of a paginated log endpoint as a tuple, or None if the current request doesn't use any of them. Aborts with 400 on invalid values."""
+    try:
+        query = bottle.request.query
+        if not any((query.since, query.until, query.limit, query.cursor)):
+            return None
+    except RuntimeError: # called outside of a request
+        return None
+    try:
+        since = api.log.parse_time(query.since) if query.since else None
+        until = api.log.parse_time(query.until) if query.until else None
+        limit = int(query.limit) if query.limit else None
+        if limit is not None and limit < 0:
+            raise ValueError('limit must not be negative')
+        if query.cursor:
+            api.log.decode_cursor(query.cursor)
+    except ValueError as e:
+        bottle.abort(400, 'Invalid page query: {}'.format(e))
+    return since, until, limit, query.cursor or None
+
 @application.route('/')
 def show_index():
     """The documentation page for version 2 of the API."""
@@ -42,6 +104,14 @@ def show_index():
         elif route.rule.endswith('.json') and any(route.rule[:-4] + 'dat' == iter_route.rule for iter_route in application.routes):
             # JSONified version of an NBT endpoint
             continue
+        elif route.rule.endswith('.ndjson'):
+            # newline-delimited version of a streaming JSON endpoint, listed with the JSON version
+            continue
+        elif route.rule.endswith('.json') and any(route.rule[:-4] + 'ndjson' == iter_route.rule for iter_route in application.routes):
+            if '<' in route.rule:
+                yield '\n<tr><td style="white-space: nowrap;">/v2' + xml.sax.saxutils.escape(route.rule) + ' (or .ndjson)</td><td>' + route.callback.__doc__.format(host=api.util.CONFIG['host']) + '</td></tr>'
+            else:
+                yield '\n<tr><td style="white-space: nowrap;"><a href="/v2' + route.rule + '">/v2' + route.rule + '</a> (or <a href="/v2' + route.rule[:-4] + 'ndjson">.ndjson</a>)</td><td>' + route.callback.__doc__.format(host=api.util.CONFIG['host']) + '</td></tr>'
         elif route.rule.endswith('.dat'):
             if '<' in route.rule:
                 yield '\n<tr><td style="white-space: nowrap;">/v2' + xml.sax.saxutils.escape(route.rule[:-4]) + '.json (or .dat)</td><td>' + route.callback.__doc__.format(host=api.util.CONFIG['host']) + '</td></tr>'
@@ -54,17 +124,58 @@ def show_index():
                 yield '\n<tr><td style="white-space: nowrap;"><a href="/v2' + route.rule + '">/v2' + route.rule + '</a></td><td>' + route.callback.__doc__.format(host=api.util.CONFIG['host']) + '</td></tr>'
     yield '</tbody></table>'
 
+@application.route('/batch', method='POST')
+def api_batch():
+    """Runs several GET requests at once. The request body is a JSON array of API paths relative to /v2, like ["/server/worlds.json", "/people.json"]. The response is an array with an object for each path, with the HTTP status code and either the JSON result or an error. The requests run concurrently and share the worlds, players, and files they load."""
+    try:
+        paths = json.loads(bottle.request.body.read().decode('utf-8'))
+        if not isinstance(paths, list) or not all(isinstance(path, str) and path.startswith('/') for path in paths):
+            raise ValueError('expected an array of paths')
+    except ValueError as e:
+        bottle.abort(400, 'Invalid batch request: {}'.format(e))
+    if len(paths) > MAX_BATCH_SIZE:
+        bottle.abort(400, 'A batch may contain at most {} paths'.format(MAX_BATCH_SIZE))
+    base_environ = {key: value for key, value in bottle.request.environ.items() if isinstance(value, str) and key not in ('HTTP_ACCEPT_ENCODING', 'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_NONE_MATCH') and not key.startswith('CONTENT_')}
+    base_environ['wsgi.errors'] = bottle.request.environ.get('wsgi.errors', sys.stderr)
+    memo = api.util2.Memo()
+
+    def run(path):
+        path, _, query_string = path.partition('?')
+        environ = dict(base_environ)
+        environ.update({
+            'api.memo': memo,
+            'HTTP_ACCEPT': 'application/json',
+            'PATH_INFO': path,
+            'QUERY_STRING': query_string,
+            'REQUEST_METHOD': 'GET',
+            'wsgi.input': io.BytesIO()
+        })
+        status = []
+        body = b''.join(application(environ, lambda status_line, headers, exc_info=None: status.append(status_line)))
+        code = int(status[0].split(' ', 1)[0])
+        if code == 200:
+            try:
+                return {'status': code, 'result': json.loads(body.decode('utf-8'))}
+            except ValueError:
+                return {'status': code, 'error': 'Not a JSON endpoint'}
+        return {'status': code, 'error': status[0]}
+
+    # sub-requests always run in worker threads, since bottle's request and response objects are thread-local and this request's must stay intact
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(BATCH_WORKERS, len(paths)))) as executor:
+        results = list(executor.map(run, paths))
+    bottle.response.content_type = 'application/json'
+    return api.util2.encoded_response([api.util2.json_dumps(results, pretty=api.util2.json_pretty_requested())])
+
 @api.util2.json_route(application, '/meta/config/api')
 def api_api_config():
     """Returns the API configuration, for debugging purposes."""
     result = {key: (str(value) if isinstance(value, pathlib.Path) else value) for key, value in api.util.CONFIG.items()}
     return result
 
-@api.util2.json_route(application, '/meta/moneys')
+@api.util2.json_route(application, '/meta/moneys', sources=lambda: [api.util.CONFIG['moneysFile']])
 def api_moneys():
     """Returns the moneys.json file."""
-    with api.util.CONFIG['moneysFile'].open() as moneys_json:
-        return json.load(moneys_json)
+    return api.util2.load_json(api.util.CONFIG['moneysFile'])
 
 @api.util2.json_route(application, '/meta/version')
 def api_version():
@@ -87,11 +198,10 @@ def api_advancement_definitions_overview():
 
     return _definitions_in_dir(api.util.CONFIG['webAssets'] / 'json' / 'advancements')
 
-@api.util2.json_route(application, '/minecraft/items/all')
+@api.util2.json_route(application, '/minecraft/items/all', sources=lambda: [api.util.CONFIG['webAssets'] / 'json' / 'items.json'])
 def api_all_items():
     """Returns the item info JSON file (<a href="http://assets.{host}/json/items.json.description.txt">documentation</a>)"""
-    with (api.util.CONFIG['webAssets'] / 'json' / 'items.json').open() as items_file:
-        return json.load(items_file)
+    return api.util2.load_json(api.util.CONFIG['webAssets'] / 'json' / 'items.json')
 
 @api.util2.json_route(application, '/minecraft/items/by-damage/<plugin>/<item_id>/<item_damage>')
 @api.util2.decode_args
@@ -121,9 +231,9 @@ def api_item_by_effect(plugin, item_id, effect_plugin, effect_id):
 @api.util2.json_route(application, '/minecraft/items/by-id/<plugin>/<item_id>')
 def api_item_by_id(plugin, item_id):
     """Returns the item info for an item with the given text ID, including variant info."""
-    all_items = api_all_items()
+    all_items = api_all_items.shared()
     if plugin in all_items and item_id in all_items[plugin]:
-        ret = all_items[plugin][item_id]
+        ret = copy.deepcopy(all_items[plugin][item_id]) # the variant endpoints modify it
     else:
         bottle.abort(404, 'No item with id {}:{}'.format(plugin, item_id))
     return ret
@@ -141,89 +251,63 @@ def api_item_by_tag_variant(plugin, item_id, tag_value):
     del ret['tagVariants']
     return ret
 
-@application.route('/minecraft/items/render/dyed-by-id/<plugin>/<item_id>/<color>.png')
-@api.util2.decode_args
-def api_item_render_dyed_png(plugin, item_id, color: 'color'):
-    """Returns a dyed item's base texture (color specified in hex rrggbb), rendered as a PNG image file."""
-    cache_path = 'dyed-items/{}/{}/{:02x}{:02x}{:02x}.png'.format(plugin, item_id, *color)
+@application.route('/minecraft/items/render/dyed-by-id/<plugin>/<item_id>/batch.png')
+def api_item_render_dyed_batch_png(plugin, item_id):
+    """Returns a dyed item's base texture in each of the colors given in the colors query parameter (comma-separated hex rrggbb, at most 256), rendered left to right as a single PNG image file."""
+    colors = bottle.request.query.colors.split(',')
+    if not 0 < len(colors) <= 256 or not all(re.fullmatch('[0-9A-Fa-f]{6}', color) for color in colors):
+        bottle.abort(400, 'The colors query parameter must be a comma-separated list of 1 to 256 hex colors in rrggbb format')
+    colors = [(int(color[:2], 16), int(color[2:4], 16), int(color[4:6], 16)) for color in colors]
+    base_path = api.util.CONFIG['webAssets'] / 'img' / 'grid-base' / api_item_by_id(plugin, item_id)['image']
 
     def image_func():
         import PIL.Image
-        import PIL.ImageChops
-
-        item = api_item_by_id(plugin, item_id)
 
-        image = PIL.Image.open(api.util.CONFIG['webAssets'] / 'img' / 'grid-base' / item['image'])
-        image = PIL.ImageChops.multiply(image, PIL.Image.new('RGBA', image.size, color=color + (255,)))
+        base = api.util2.texture(base_path)
+        image = PIL.Image.new('RGBA', (len(colors) * base.size[0], base.size[1]), color=(0, 0, 0, 0))
+        for i, color in enumerate(colors):
+            image.paste(api.util.dye_image(base, color), (i * base.size[0], 0))
         return image
 
-    def cache_check(image_path):
-        if not image_path.exists():
-            return False
-        return True #TODO check if base texture has changed
+    return api.util2.cached_image(['dyed-item-batch', ['{:02x}{:02x}{:02x}'.format(*color) for color in colors], api.util2.file_digest(base_path)], image_func)
 
-    return api.util2.cached_image(cache_path, image_func, cache_check)
+@application.route('/minecraft/items/render/dyed-by-id/<plugin>/<item_id>/<color>.png')
+@api.util2.decode_args
+def api_item_render_dyed_png(plugin, item_id, color: 'color'):
+    """Returns a dyed item's base texture (color specified in hex rrggbb), rendered as a PNG image file."""
+    base_path = api.util.CONFIG['webAssets'] / 'img' / 'grid-base' / api_item_by_id(plugin, item_id)['image']
 
-@api.util2.json_route(application, '/minigame/achievements/<world>/scoreboard')
+    def image_func():
+        return api.util.dye_image(api.util2.texture(base_path), color)
+
+    return api.util2.cached_image(['dyed-item', '{:02x}{:02x}{:02x}'.format(*color), api.util2.file_digest(base_path)], image_func)
+
+@api.util2.json_route(application, '/minigame/achievements/<world>/scoreboard', sources=stats_sources)
 @api.util2.decode_args
 def api_achievement_scores(world: minecraft.World):
     """Returns an object mapping player's IDs to their current score in the achievement run."""
-    return {player_id: more_itertools.quantify((value['value'] if isinstance(value, dict) else value) > 0 for value in achievement_data.values()) for player_id, achievement_data in api_playerstats_achievements(world).items()}
+    return {player_id: more_itertools.quantify((value['value'] if isinstance(value, dict) else value) > 0 for value in achievement_data.values()) for player_id, achievement_data in api_playerstats_achievements.shared(world).items()}
 
-@api.util2.json_route(application, '/minigame/achievements/<world>/winners')
+@api.util2.json_route(application, '/minigame/achievements/<world>/winners', sources=lambda world: stats_sources(world) + log_sources(world) + [api.util.CONFIG['webAssets'] / 'json' / 'achievements.json'], precompute=each_world)
 @api.util2.decode_args
 def api_achievement_winners(world: minecraft.World):
     """Returns an object mapping IDs of players who have completed all achievements to the UTC datetime they got their last achievement. This list is emptied each time a new achievement is added to Minecraft."""
     # get the current number of achievements
-    with (api.util.CONFIG['webAssets'] / 'json' / 'achievements.json').open() as achievements_f:
-        num_achievements = len(json.load(achievements_f))
+    num_achievements = len(api.util2.load_json(api.util.CONFIG['webAssets'] / 'json' / 'achievements.json'))
     # get the set of players who have completed all achievements
-    winners = {api.util2.Player(player) for player, score in api_achievement_scores(world).items() if score == num_achievements}
-    # load from cache
-    cache_path = api.util.CONFIG['cache'] / 'achievement-winners.json'
-    try:
-        with cache_path.open() as cache_f:
-            cache = json.load(cache_f)
-        if cache['numAchievements'] == num_achievements:
-            # no new achievements introduced, start with the cache
-            result = cache['result']
-            winners -= {api.util2.Player(player) for player in result}
-        else:
-            # new achievements introduced, any completions must have happened since cache creation
-            result = {}
-        log = api.log.Log(world)[datetime.date.fromtimestamp(cache_path.stat().st_mtime) - datetime.timedelta(days=2):].reversed() # only look at the new logs, plus 2 more days to account for timezone weirdness
-    except:
-        result = {}
-        log = api.log.Log(world).reversed()
-    # look for new completions
-    if len(winners) > 0:
-        for line in log:
-            if line.type is api.log.LineType.achievement and line.data['player'] in winners:
-                result[str(line.data['player'])] = line.data['time'].strftime('%Y-%m-%d %H:%M:%S')
-                winners.remove(line.data['player'])
-                if len(winners) == 0:
-                    break
-    # write to cache
-    if api.util.CONFIG['cache'].exists():
-        with cache_path.open('w') as cache_f:
-            json.dump({
-                'numAchievements': num_achievements,
-                'result': result
-            }, cache_f, sort_keys=True, indent=4)
-    return result
+    winners = {str(api.util2.Player(player)) for player, score in api_achievement_scores.shared(world).items() if score == num_achievements}
+    # the last achievement of each winner was the one that completed the set
+    return {player_id: timestamp for player_id, timestamp in api.aggregates.last_achievements(world).items() if player_id in winners}
 
-@api.util2.json_route(application, '/minigame/deathgames/log')
+@api.util2.json_route(application, '/minigame/deathgames/log', sources=lambda: [api.util.CONFIG['logPath'] / 'deathgames.json'])
 def api_death_games_log():
     """Returns the <a href="http://wiki.{host}/Death_Games">Death Games</a> log, listing attempts in chronological order."""
-    with (api.util.CONFIG['logPath'] / 'deathgames.json').open() as death_games_logfile:
-        return json.load(death_games_logfile)
+    return api.util2.load_json(api.util.CONFIG['logPath'] / 'deathgames.json')
 
 @api.util2.json_route(application, '/people')
 def api_player_people():
     """Returns the whole <a href="http://wiki.{host}/People_file/Version_3">people.json</a> file, except for the "gravatar" private field, which is replaced by the gravatar URL."""
-    import people
-
-    db = people.get_people_db().obj_dump(version=3)
+    db = copy.deepcopy(api.util2.people_dump())
     for person in db['people'].values():
         if 'gravatar' in person:
             person['gravatar'] = 'https://www.gravatar.com/avatar/{}'.format(hashlib.md5(person['gravatar'].encode('utf-8')).hexdigest())
@@ -233,7 +317,7 @@ def api_player_people():
 @api.util2.decode_args
 def api_player_info(player: api.util2.Player):
     """Returns the section of <a href="http://wiki.{host}/People_file/Version_3">people.json</a> that corresponds to the player, except for the "gravatar" private field, which is replaced by the gravatar URL."""
-    person_data = player.data
+    person_data = copy.deepcopy(player.data)
     if 'gravatar' in person_data:
         person_data['gravatar'] = 'https://www.gravatar.com/avatar/{}'.format(hashlib.md5(person_data['gravatar'].encode('utf-8')).hexdigest())
     return person_data
@@ -242,35 +326,31 @@ def api_player_info(player: api.util2.Player):
 @api.util2.decode_args
 def api_skin_render_front_png(player: api.util2.Player, size: range(1025)):
     """Returns a player skin in front view (including the overlay layers), as a &lt;size&gt;×(2*&lt;size&gt;)px PNG image file. Requires playerhead."""
-    def image_func():
-        import playerhead
+    texture_key = api.util2.skin_texture_key(player)
 
-        return playerhead.body(player.data['minecraft']['nicks'][-1], profile_id=player.uuid).resize((size, 2 * size))
+    def image_func():
+        return api.util2.skin_render(player, 'body', texture_key).resize((size, 2 * size))
 
-    return api.util2.cached_image('skins/front-views/{}/{}.png'.format(size, player), image_func, api.util2.skin_cache_check)
+    return api.util2.cached_image(['skin-front', texture_key, size], image_func)
 
 @application.route('/player/<player>/skin/render/head/<size>.png')
 @api.util2.decode_args
 def api_skin_render_head_png(player: api.util2.Player, size: range(1025)):
     """Returns a player skin's head (including the hat layer), as a &lt;size&gt;×&lt;size&gt;px PNG image file. Requires playerhead."""
-    def image_func():
-        import playerhead
+    texture_key = api.util2.skin_texture_key(player)
 
-        return playerhead.head(player.data['minecraft']['nicks'][-1], profile_id=player.uuid).resize((size, size))
+    def image_func():
+        return api.util2.skin_render(player, 'head', texture_key).resize((size, size))
 
-    return api.util2.cached_image('skins/heads/{}/{}.png'.format(size, player), image_func, api.util2.skin_cache_check)
+    return api.util2.cached_image(['skin-head', texture_key, size], image_func)
 
-@api.util2.json_route(application, '/world/<world>/advancements/all')
+@api.util2.json_route(application, '/world/<world>/advancements/all', object_pairs=True, sources=lambda world: [world.world_path / 'advancements'] + people_sources())
 @api.util2.decode_args
 def api_advancements(world: minecraft.World):
     """Returns all advancements.json files for this world. Timestamps are normalized to UTC."""
-    data = {}
-    for advancements_path in (world.world_path / 'advancements').iterdir():
-        if advancements_path.suffix == '.json':
-            player = api.util2.Player(advancements_path.stem)
-            with advancements_path.open() as advancements_file:
-                data[str(player)] = api.util2.normalize_advancements(json.load(advancements_file))
-    return data
+    for player_id, advancements_path in player_files(world.world_path / 'advancements', '.json'):
+        with advancements_path.open() as advancements_file:
+            yield player_id, api.util2.normalize_advancements(json.load(advancements_file))
 
 @application.route('/world/<world>/backup/latest.tar.gz')
 @api.util2.decode_args
@@ -311,34 +391,11 @@ def api_region_overview(world: minecraft.World):
                     })
     return result
 
-@api.util2.json_route(application, '/world/<world>/chunks/overview')
+@api.util2.json_route(application, '/world/<world>/chunks/overview', sources=lambda world: [dimension.region_path(world) for dimension in api.util2.Dimension], precompute=each_world)
 @api.util2.decode_args
 def api_chunk_overview(world: minecraft.World):
     """Returns a list of all chunk columns that have been generated, grouped by dimension."""
-    import mcanvil
-
-    cache_path = api.util.CONFIG['cache'] / 'chunks.json'
-    if cache_path.exists():
-        with cache_path.open() as cache_f:
-            cache = json.load(cache_f)
-    else:
-        cache = {dimension.name: {} for dimension in api.util2.Dimension}
-    result = {}
-    for dimension in api.util2.Dimension:
-        if dimension.region_path(world).exists():
-            result[dimension.name] = []
-            for region_path in dimension.region_path(world).iterdir():
-                if region_path.suffix != '.mca':
-                    continue
-                if region_path.stem not in cache[dimension.name] or region_path.stat().st_mtime > cache[dimension.name][region_path.stem]['mtime']:
-                    cache[dimension.name][region_path.stem] = {
-                        'data': [{'x': col.x, 'z': col.z} for col in mcanvil.Region(region_path)],
-                        'mtime': region_path.stat().st_mtime
-                    }
-                result[dimension.name] += cache[dimension.name][region_path.stem]['data']
-    with cache_path.open('w') as cache_f:
-        json.dump(cache, cache_f, indent=4, sort_keys=True)
-    return result
+    return api.aggregates.chunk_columns(world)
 
 @api.util2.nbt_route(application, '/world/<world>/chunks/<dimension>/column/<x>/<z>')
 @api.util2.decode_args
@@ -356,6 +413,13 @@ def api_chunk_info(world: minecraft.World, dimension: api.util2.Dimension, x: in
     """Returns information about the given chunk section in JSON format. The nested arrays can be indexed in y-z-x order."""
     return api.util2.chunk_section_info(api_chunk_column.dict(world, dimension, x, z), x, y, z)
 
+@application.route('/world/<world>/chunks/<dimension>/chunk/<x>/<y>/<z>.bin')
+@api.util2.decode_args
+def api_chunk_info_bin(world: minecraft.World, dimension: api.util2.Dimension, x: int, y: range(16), z: int):
+    """Returns the given chunk section in a compact binary format: a 20-byte header (b"WMCS", format version, flags, x, y, z, palette size), the column's 256 biome IDs, a palette of (block ID, damage) pairs, 4096 palette indices in y-z-x order, and the block light and sky light arrays. All integers are big-endian. The exact layout is documented in api.util2.chunk_section_binary."""
+    bottle.response.content_type = 'application/octet-stream'
+    return api.util2.chunk_section_binary(api_chunk_column.dict(world, dimension, x, z), x, y, z)
+
 @api.util2.json_route(application, '/world/<world>/chunks/<dimension>/block/<x>/<y>/<z>')
 @api.util2.decode_args
 def api_block_info(world: minecraft.World, dimension: api.util2.Dimension, x: int, y: range(256), z: int):
@@ -365,7 +429,66 @@ def api_block_info(world: minecraft.World, dimension: api.util2.Dimension, x: in
     chunk_z, block_z = divmod(z, 16)
     return api_chunk_info(world, dimension, chunk_x, chunk_y, chunk_z)[block_y][block_z][block_x]
 
-@api.util2.json_route(application, '/world/<world>/deaths/latest')
+@api.util2.json_route(application, '/world/<world>/chunks/<dimension>/blocks', method='POST', streamed=True)
+@api.util2.decode_args
+def api_blocks_info(world: minecraft.World, dimension: api.util2.Dimension):
+    """Returns information about many blocks at once, in the format used by /v2/world/&lt;world&gt;/chunks/&lt;dimension&gt;/block/&lt;x&gt;/&lt;y&gt;/&lt;z&gt;.json. POST a JSON object with either a "blocks" array of {{"x": ..., "y": ..., "z": ...}} objects, or "min" and "max" objects of the same form specifying the corners of a box (inclusive). Results are ordered by chunk column, and at most 262144 blocks can be requested at once."""
+    def is_coord(value):
+        return isinstance(value, int) and not isinstance(value, bool) # JSON true and false are ints in Python
+
+    try:
+        query = json.loads(bottle.request.body.read().decode('utf-8'))
+        if 'blocks' in query:
+            coords = {(block['x'], block['y'], block['z']) for block in query['blocks']}
+        else:
+            box_min = query['min']['x'], query['min']['y'], query['min']['z']
+            box_max = query['max']['x'], query['max']['y'], query['max']['z']
+            if not all(is_coord(coord) for coord in box_min + box_max):
+                raise TypeError('Box corners must have integer coordinates')
+            num_blocks = 1
+            for min_coord, max_coord in zip(box_min, box_max):
+                num_blocks *= max(0, max_coord - min_coord + 1)
+            if num_blocks > MAX_BULK_BLOCKS:
+                bottle.abort(413, 'At most {} blocks can be requested at once'.format(MAX_BULK_BLOCKS))
+            coords = itertools.product(*(range(min_coord, max_coord + 1) for min_coord, max_coord in zip(box_min, box_max)))
+        regions = collections.defaultdict(lambda: collections.defaultdict(list))
+        for i, (x, y, z) in enumerate(coords):
+            if i >= MAX_BULK_BLOCKS:
+                bottle.abort(413, 'At most {} blocks can be requested at once'.format(MAX_BULK_BLOCKS))
+            if not all(is_coord(coord) for coord in (x, y, z)):
+                raise TypeError('Block coordinates must be integers')
+            if y not in range(256):
+                bottle.abort(403, 'Parameter y must be in range(256)')
+            regions[x // 512, z // 512][x // 16, z // 16].append((x, y, z))
+    except (KeyError, TypeError, ValueError) as e:
+        bottle.abort(400, 'Invalid block query: {}'.format(e))
+    return blocks_info(world, dimension, regions) # validated before the response starts
+
+def blocks_info(world, dimension, regions):
+    """Yields the results of a bulk block query, see api_blocks_info. regions maps region coordinates to dicts mapping chunk column coordinates to lists of block coordinates."""
+    import mcanvil
+
+    biomes = api.util2.biome_names()
+    blocks = api.util2.block_names()
+    for (region_x, region_z), columns in sorted(regions.items()):
+        region_path = dimension.region_path(world) / 'r.{}.{}.mca'.format(region_x, region_z)
+        existing_columns = {(column['x'], column['z']) for column in api.region.chunk_columns(region_path)} if region_path.exists() else set()
+        region = None
+        for (column_x, column_z), column_coords in sorted(columns.items()):
+            if (column_x, column_z) not in existing_columns:
+                for x, y, z in column_coords:
+                    yield {
+                        'x': x,
+                        'y': y,
+                        'z': z
+                    }
+                continue
+            if region is None:
+                region = mcanvil.Region(region_path)
+            column = api.util2.nbt_to_dict(region.chunk_column(column_x, column_z).data)
+            yield from api.util2.column_blocks_info(column, column_coords, biomes=biomes, blocks=blocks)
+
+@api.util2.json_route(application, '/world/<world>/deaths/latest', sources=lambda world: log_sources(world) + [len(api.log.death_messages)])
 @api.util2.decode_args
 def api_latest_deaths(world: minecraft.World):
     """Returns JSON containing information about the most recent death of each player"""
@@ -373,42 +496,17 @@ def api_latest_deaths(world: minecraft.World):
         player_id, deaths = item
         return datetime.datetime.strptime(deaths[-1]['timestamp'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
 
-    all_deaths = api_deaths(world)
+    all_deaths = api_deaths.shared(world)
     return {
         'deaths': {player_id: deaths[-1] for player_id, deaths in all_deaths.items()},
         'lastPerson': more_itertools.first(sorted(all_deaths.items(), key=newest_timestamp, reverse=True), (None, []))[0]
     }
 
-@api.util2.json_route(application, '/world/<world>/deaths/all')
+@api.util2.json_route(application, '/world/<world>/deaths/all', sources=lambda world: log_sources(world) + [len(api.log.death_messages)], precompute=each_world)
 @api.util2.decode_args
 def api_deaths(world: minecraft.World):
     """Returns JSON containing information about all player deaths"""
-    # load from cache
-    cache_path = api.util.CONFIG['cache'] / 'all-deaths.json'
-    result = collections.defaultdict(list)
-    log = api.log.Log(world)
-    if cache_path.exists():
-        with cache_path.open() as cache_f:
-            with contextlib.suppress(ValueError):
-                cache = json.load(cache_f)
-                if cache['numMessages'] == len(api.log.death_messages):
-                    result.update(cache['deaths'])
-                    log = api.log.Log(world)[datetime.date.fromtimestamp(cache_path.stat().st_mtime) - datetime.timedelta(days=2):] # only look at the new logs, plus 2 more days to account for timezone weirdness
-    # look for new deaths
-    for line in log:
-        if line.type is api.log.LineType.death:
-            result[str(line.data['player'])].append({
-                'cause': line.data['cause'],
-                'timestamp': line.data['time'].strftime('%Y-%m-%d %H:%M:%S')
-            })
-    # write to cache
-    if api.util.CONFIG['cache'].exists():
-        with cache_path.open('w') as cache_f:
-            json.dump({
-                'deaths': result,
-                'numMessages': len(api.log.death_messages)
-            }, cache_f, sort_keys=True, indent=4)
-    return result
+    return api.aggregates.deaths(world)
 
 @api.util2.nbt_route(application, '/world/<world>/level')
 @api.util2.decode_args
@@ -416,14 +514,34 @@ def api_level(world: minecraft.World):
     """Returns the level.dat encoded as JSON"""
     return world.world_path / 'level.dat'
 
-@api.util2.json_route(application, '/world/<world>/logs/all')
+@api.util2.json_route(application, '/world/<world>/logs/all', sources=log_sources)
 @api.util2.decode_args
 def api_logs_all(world: minecraft.World):
-    """Returns a JSON-formatted version of all available logs for the world. Warning: this file is potentially very big. Please use one of the other APIs if possible."""
-    for line in api.log.Log(world):
-        yield line.as_json()
+    """Returns a JSON-formatted version of all available logs for the world. Warning: this file is potentially very big. Please use one of the other APIs if possible, or paginate using the optional query parameters since and until (UTC, %Y-%m-%d or %Y-%m-%d %H:%M:%S) and limit. When paginating, each line has a cursor field, which can be passed as the cursor query parameter to continue after that line without rereading the logs before it."""
+    page = log_page_query()
+    if page is None:
+        for line in api.log.Log(world):
+            yield line.as_json()
+        return
+    since, until, limit, cursor = page
+    log = api.log.Log(world)
+    if since is not None and cursor is None:
+        log = log[since.date() - datetime.timedelta(days=2):] # plus 2 more days to account for timezone weirdness
+    count = 0
+    for line, _, end in log.positioned(cursor):
+        if limit is not None and count >= limit:
+            break
+        time = line.data.get('time')
+        if until is not None and time is not None and time >= until:
+            break
+        if since is not None and (time is None or time < since):
+            continue
+        result = line.as_json()
+        result['cursor'] = end
+        yield result
+        count += 1
 
-@api.util2.json_route(application, '/world/<world>/logs/latest')
+@api.util2.json_route(application, '/world/<world>/logs/latest', sources=lambda world: [world.path / 'logs' / 'latest.log'] + people_sources())
 @api.util2.decode_args
 def api_logs_latest(world: minecraft.World):
     """Returns a JSON-formatted version of the world's latest.log"""
@@ -436,7 +554,7 @@ def api_map_by_id(world: minecraft.World, identifier: int):
     """Returns info about the map item with damage value &lt;identifier&gt;, see <a href="http://minecraft.gamepedia.com/Map_Item_Format">Map Item Format</a> for documentation"""
     return world.world_path / 'data' / 'map_{}.dat'.format(identifier)
 
-@api.util2.json_route(application, '/world/<world>/maps/overview')
+@api.util2.json_route(application, '/world/<world>/maps/overview', sources=lambda world: [world.world_path / 'data'])
 @api.util2.decode_args
 def api_maps_index(world: minecraft.World):
     """Returns a list of existing maps with all of their fields except for the actual colors."""
@@ -455,19 +573,30 @@ def api_maps_index(world: minecraft.World):
 @api.util2.decode_args
 def api_map_render_png(world: minecraft.World, identifier: int):
     """Returns the map item with damage value &lt;identifier&gt;, rendered as a PNG image file."""
-    def cache_check(image_path):
-        if not image_path.exists():
-            return False
-        if image_path.stat().st_mtime < (world.world_path / 'data' / 'map_{}.dat'.format(identifier)).stat().st_mtime + 60:
-            return False
-        return True
+    map_path = world.world_path / 'data' / 'map_{}.dat'.format(identifier)
 
     def image_func():
-        return api.util.map_image(api_map_by_id(world, identifier))
+        return api.util2.map_render(map_path)
 
-    return api.util2.cached_image('map-renders/{}.png'.format(identifier), image_func, cache_check)
+    return api.util2.cached_image(['map', api.util2.file_digest(map_path)], image_func)
 
-@api.util2.json_route(application, '/world/<world>/player/<player>/advancements')
+@application.route('/world/<world>/maps/wall.png')
+@api.util2.decode_args
+def api_map_wall_png(world: minecraft.World):
+    """Returns several map items arranged in a grid, rendered as a single PNG image file. The ids query parameter is a comma-separated list of map damage values in row-major order (at most 1024, leave an entry empty for a gap), and cols is the number of columns (defaults to the number of maps). The composite is cached and only the maps that changed are redrawn."""
+    query = bottle.request.query
+    try:
+        ids = [None if map_id == '' else int(map_id) for map_id in query.ids.split(',')]
+        cols = int(query.cols) if query.cols else len(ids)
+        if not 0 < len(ids) <= 1024 or cols <= 0:
+            raise ValueError('between 1 and 1024 ids and a positive number of columns are required')
+    except ValueError as e:
+        bottle.abort(400, 'Invalid map wall query: {}'.format(e))
+    map_paths = [None if map_id is None else world.world_path / 'data' / 'map_{}.dat'.format(map_id) for map_id in ids]
+    image_path = api.util2.map_wall(map_paths, cols)
+    return bottle.static_file(image_path.name, str(image_path.parent), mimetype='image/png')
+
+@api.util2.json_route(application, '/world/<world>/player/<player>/advancements', sources=lambda world, player: [world.world_path / 'advancements' / '{}.json'.format(player.uuid)] + people_sources())
 @api.util2.decode_args
 def api_player_advancements(world: minecraft.World, player: api.util2.Player):
     """Returns the advancements.json for this player. Timestamps are normalized to UTC."""
@@ -483,7 +612,7 @@ def api_player_data(world: minecraft.World, player: api.util2.Player):
     """Returns the <a href="http://minecraft.gamepedia.com/Player.dat_format">player data</a> encoded as JSON"""
     return world.world_path / 'playerdata' / '{}.dat'.format(player.uuid)
 
-@api.util2.json_route(application, '/world/<world>/player/<player>/stats')
+@api.util2.json_route(application, '/world/<world>/player/<player>/stats', sources=stats_sources)
 @api.util2.decode_args
 def api_player_stats(world: minecraft.World, player: api.util2.Player):
     """Returns the player's stats formatted as JSON with stats grouped into objects by category"""
@@ -495,18 +624,14 @@ def api_player_stats(world: minecraft.World, player: api.util2.Player):
         stats = json.load(stats_file)
     return api.util.format_stats(stats)
 
-@api.util2.json_route(application, '/world/<world>/playerdata/all')
+@api.util2.json_route(application, '/world/<world>/playerdata/all', object_pairs=True, sources=lambda world: [world.world_path / 'playerdata'] + people_sources())
 @api.util2.decode_args
 def api_player_data_all(world: minecraft.World):
     """Returns the player data of all known players, encoded as JSON"""
-    nbt_dicts = {}
-    for data_path in (world.world_path / 'playerdata').iterdir():
-        if data_path.suffix == '.dat':
-            player = api.util2.Player(data_path.stem)
-            nbt_dicts[str(player)] = api.util2.nbtfile_to_dict(data_path)
-    return nbt_dicts
+    for player_id, data_path in player_files(world.world_path / 'playerdata', '.dat'):
+        yield player_id, api.util2.nbtfile_to_dict(data_path)
 
-@api.util2.json_route(application, '/world/<world>/playerdata/by-id/<identifier>')
+@api.util2.json_route(application, '/world/<world>/playerdata/by-id/<identifier>', sources=lambda world: [world.world_path / 'playerdata'] + people_sources())
 @api.util2.decode_args
 def api_player_data_by_id(world: minecraft.World, identifier):
     """Returns a dictionary with player IDs as the keys, and their player data fields &lt;identifier&gt; as the values"""
@@ -519,20 +644,15 @@ def api_player_data_by_id(world: minecraft.World, identifier):
                 data[player] = playerdata[name]
     return data
 
-@api.util2.json_route(application, '/world/<world>/playerstats/all')
+@api.util2.json_route(application, '/world/<world>/playerstats/all', object_pairs=True, sources=stats_sources)
 @api.util2.decode_args
 def api_playerstats(world: minecraft.World):
     """Returns all stats for all players in one file."""
-    data = {}
-    stats_dir = world.world_path / 'stats'
-    for stats_path in stats_dir.iterdir():
-        if stats_path.suffix == '.json':
-            with stats_path.open() as stats_file:
-                person = api.util2.Player(stats_path.stem)
-                data[str(person)] = api.util.format_stats(json.load(stats_file))
-    return data
+    for player_id, stats_path in player_files(world.world_path / 'stats', '.json'):
+        with stats_path.open() as stats_file:
+            yield player_id, api.util.format_stats(json.load(stats_file))
 
-@api.util2.json_route(application, '/world/<world>/playerstats/achievement')
+@api.util2.json_route(application, '/world/<world>/playerstats/achievement', sources=stats_sources)
 @api.util2.decode_args
 def api_playerstats_achievements(world: minecraft.World):
     """Returns all achievement stats in one file. Does not include players who have logged in since 17w13a."""
@@ -543,7 +663,7 @@ def api_playerstats_achievements(world: minecraft.World):
             data[player_id] = player_data['achievement']
     return data
 
-@api.util2.json_route(application, '/world/<world>/playerstats/by-id/<identifier>')
+@api.util2.json_route(application, '/world/<world>/playerstats/by-id/<identifier>', sources=stats_sources)
 @api.util2.decode_args
 def api_playerstats_by_id(world: minecraft.World, identifier):
     """Returns the stat item &lt;identifier&gt; from all player stats."""
@@ -553,18 +673,16 @@ def api_playerstats_by_id(world: minecraft.World, identifier):
     for player_id, player_data in all_data.items():
         parent = player_data
         for key in key_path[:-1]:
-            if key not in parent:
-                parent[key] = {}
-            elif not isinstance(parent[key], dict):
-                parent[key] = {'summary': parent[key]}
-            parent = parent[key]
+            parent = parent.get(key, {})
+            if not isinstance(parent, dict):
+                parent = {'summary': parent}
         if key_path[-1] in parent:
             data[player_id] = parent[key_path[-1]]
     if len(data) == 0: #TODO only error if the stat is also not found in assets
         bottle.abort(404, 'Identifier not found')
     return data
 
-@api.util2.json_route(application, '/world/<world>/playerstats/entity')
+@api.util2.json_route(application, '/world/<world>/playerstats/entity', sources=stats_sources)
 @api.util2.decode_args
 def api_playerstats_entities(world: minecraft.World):
     """Returns all entity stats in one file"""
@@ -578,7 +696,7 @@ def api_playerstats_entities(world: minecraft.World):
                 data[player_id][stat_str] = value
     return data
 
-@api.util2.json_route(application, '/world/<world>/playerstats/general')
+@api.util2.json_route(application, '/world/<world>/playerstats/general', sources=stats_sources)
 @api.util2.decode_args
 def api_playerstats_general(world: minecraft.World):
     """Returns all general stats in one file"""
@@ -600,7 +718,7 @@ def api_playerstats_general(world: minecraft.World):
             data[player_id] = filtered
     return data
 
-@api.util2.json_route(application, '/world/<world>/playerstats/item')
+@api.util2.json_route(application, '/world/<world>/playerstats/item', sources=stats_sources)
 @api.util2.decode_args
 def api_playerstats_items(world: minecraft.World):
     """Returns all item and block stats in one file"""
@@ -620,102 +738,130 @@ def api_scoreboard(world: minecraft.World):
     """Returns the scoreboard data encoded as JSON"""
     return world.world_path / 'data' / 'scoreboard.dat'
 
-@api.util2.json_route(application, '/world/<world>/sessions/all')
+@api.util2.json_route(application, '/world/<world>/sessions/all', sources=log_sources)
 @api.util2.decode_args
 def api_sessions(world: minecraft.World):
-    """Returns all player sessions since the first logged server start"""
-    log = api.log.Log(world)
-    current_uptime = None
-    for line in log:
-        if line.type is api.log.LineType.start:
-            start_time_str = line.data['time'].strftime('%Y-%m-%d %H:%M:%S')
-            if current_uptime is not None:
-                current_uptime['endTime'] = start_time_str
-                for session in current_uptime.get('sessions', []):
-                    if 'leaveTime' not in session:
-                        session['leaveTime'] = start_time_str
-                        session['leaveReason'] = 'serverStartOverride'
-                yield current_uptime
-            current_uptime = {
-                'startTime': start_time_str,
-                'version': line.data['version']
-            }
-        elif line.type is api.log.LineType.stop:
-            stop_time_str = line.data['time'].strftime('%Y-%m-%d %H:%M:%S')
-            if current_uptime is not None:
-                current_uptime['endTime'] = stop_time_str
+    """Returns all player sessions since the first logged server start. Supports the same pagination as /world/&lt;world&gt;/logs/all, with since and until applying to server uptimes. An uptime's cursor continues after it, or before it if it is still ongoing, so polling with the last cursor returns the current uptime until it ends."""
+    def uptimes(lines):
+        current_uptime = None
+        for line, start, end in lines:
+            if line.type is api.log.LineType.start:
+                start_time_str = line.data['time'].strftime('%Y-%m-%d %H:%M:%S')
+                if current_uptime is not None:
+                    current_uptime['endTime'] = start_time_str
+                    for session in current_uptime.get('sessions', []):
+                        if 'leaveTime' not in session:
+                            session['leaveTime'] = start_time_str
+                            session['leaveReason'] = 'serverStartOverride'
+                    yield current_uptime, start
+                current_uptime = {
+                    'startTime': start_time_str,
+                    'version': line.data['version']
+                }
+                current_uptime_start = start
+            elif line.type is api.log.LineType.stop:
+                stop_time_str = line.data['time'].strftime('%Y-%m-%d %H:%M:%S')
+                if current_uptime is not None:
+                    current_uptime['endTime'] = stop_time_str
+                    for session in current_uptime.get('sessions', []):
+                        if 'leaveTime' not in session:
+                            session['leaveTime'] = stop_time_str
+                            session['leaveReason'] = 'serverStop'
+                    yield current_uptime, end
+                    current_uptime = None
+            elif line.type is api.log.LineType.join:
+                if current_uptime is None:
+                    continue
+                join_time_str = line.data['time'].strftime('%Y-%m-%d %H:%M:%S')
+                if 'sessions' not in current_uptime:
+                    current_uptime['sessions'] = []
+                current_uptime['sessions'].append({
+                    'joinTime': join_time_str,
+                    'person': str(line.data['player'])
+                })
+            elif line.type is api.log.LineType.leave:
+                if current_uptime is None:
+                    continue
+                leave_time_str = line.data['time'].strftime('%Y-%m-%d %H:%M:%S')
                 for session in current_uptime.get('sessions', []):
-                    if 'leaveTime' not in session:
-                        session['leaveTime'] = stop_time_str
-                        session['leaveReason'] = 'serverStop'
-                yield current_uptime
-                current_uptime = None
-        elif line.type is api.log.LineType.join:
-            if current_uptime is None:
-                continue
-            join_time_str = line.data['time'].strftime('%Y-%m-%d %H:%M:%S')
-            if 'sessions' not in current_uptime:
-                current_uptime['sessions'] = []
-            current_uptime['sessions'].append({
-                'joinTime': join_time_str,
-                'person': str(line.data['player'])
-            })
-        elif line.type is api.log.LineType.leave:
-            if current_uptime is None:
-                continue
-            leave_time_str = line.data['time'].strftime('%Y-%m-%d %H:%M:%S')
-            for session in current_uptime.get('sessions', []):
-                if 'leaveTime' not in session and session['person'] == str(line.data['player']):
-                    session['leaveTime'] = leave_time_str
-                    session['leaveReason'] = 'logout'
-                    break
+                    if 'leaveTime' not in session and session['person'] == str(line.data['player']):
+                        session['leaveTime'] = leave_time_str
+                        session['leaveReason'] = 'logout'
+                        break
 
-    if current_uptime is not None:
-        for session in current_uptime.get('sessions', []):
-            if 'leaveTime' not in session:
-                session['leaveReason'] = 'currentlyOnline'
-        yield current_uptime
+        if current_uptime is not None:
+            for session in current_uptime.get('sessions', []):
+                if 'leaveTime' not in session:
+                    session['leaveReason'] = 'currentlyOnline'
+            yield current_uptime, current_uptime_start
+
+    page = log_page_query()
+    if page is None:
+        for uptime, _ in uptimes((line, None, None) for line in api.log.Log(world)):
+            yield uptime
+        return
+    since, until, limit, cursor = page
+    log = api.log.Log(world)
+    if since is not None and cursor is None:
+        log = log.since_last_start(since.date() - datetime.timedelta(days=2)) # plus 2 more days to account for timezone weirdness
+    count = 0
+    for uptime, uptime_cursor in uptimes(log.positioned(cursor)):
+        if limit is not None and count >= limit:
+            break
+        if until is not None and api.log.parse_time(uptime['startTime']) >= until:
+            break
+        if since is not None and 'endTime' in uptime and api.log.parse_time(uptime['endTime']) < since:
+            continue
+        uptime['cursor'] = uptime_cursor
+        yield uptime
+        count += 1
 
-@api.util2.json_route(application, '/world/<world>/sessions/lastseen')
+@api.util2.json_route(application, '/world/<world>/sessions/lastseen', sources=log_sources, precompute=each_world)
 @api.util2.decode_args
 def api_sessions_last_seen_world(world: minecraft.World):
     """Returns the last known session for each player"""
-    # load from cache
-    cache_path = api.util.CONFIG['cache'] / 'last-seen' / '{}.json'.format(world)
-    try:
-        with cache_path.open() as cache_f:
-            result = json.load(cache_f)
-        log = api.log.Log(world)[datetime.date.fromtimestamp(cache_path.stat().st_mtime) - datetime.timedelta(days=2):] # only look at the new logs, plus 2 more days to account for timezone weirdness
-    except:
-        result = {}
-        log = api.log.Log(world)
-    # look for new join/leave lines
-    for line in log:
-        if line.type is api.log.LineType.join or line.type is api.log.LineType.leave:
-            result[str(line.data['player'])] = line.data['time'].strftime('%Y-%m-%d %H:%M:%S')
-    # write to cache
-    if api.util.CONFIG['cache'].exists():
-        if not cache_path.parent.exists():
-            cache_path.parent.mkdir()
-        with cache_path.open('w') as cache_f:
-            json.dump(result, cache_f, sort_keys=True, indent=4)
-    return result
+    return api.aggregates.last_seen(world)
 
 @api.util2.json_route(application, '/world/<world>/status')
 @api.util2.decode_args
 def api_world_status(world: minecraft.World):
-    """Returns JSON containing info about the given world, including whether the server is running, the current Minecraft version, and the list of people who are online. Requires mcstatus."""
-    import mcstatus
+    """Returns JSON containing info about the given world, including whether the server is running, the current Minecraft version, and the list of people who are online. The status is checked in the background every few seconds; the updated field is the UTC time of the last check. The list of people who are online requires mcstatus."""
+    result = api.status.world_status(world)
+    if result is None:
+        bottle.abort(503, 'The status of this world is not available yet')
+    return result
 
-    result = api.util2.short_world_status(world)
-    server = mcstatus.MinecraftServer.lookup(api.util.CONFIG['worldHost'] if world.is_main else '{}.{}'.format(world, api.util.CONFIG['worldHost']))
+@api.util2.json_route(application, '/world/<world>/tile-entities/search')
+@api.util2.decode_args
+def api_tile_entity_search(world: minecraft.World):
+    """Returns a list of tile entities (such as chests, signs, or spawners) in the world, with their dimension added. The optional query parameters dimension, id (tile entity ID), text (part of a sign's text or a custom name), item (ID of a contained item), bbox (x1,y1,z1,x2,y2,z2), and limit (default 1000) narrow down the results. Results come from an index which is updated in the background, so recent changes may take a minute or two to show up. If the API has no cache directory, the world is scanned on each request instead. Requires python-anvil."""
+    query = bottle.request.query
     try:
-        status = server.status()
-    except ConnectionRefusedError:
-        result['list'] = []
-    else:
-        result['list'] = [str(api.util2.Player(player.id)) for player in (status.players.sample or [])]
-    return result
+        dimension = api.util2.Dimension[query.dimension] if query.dimension else None
+        if query.bbox:
+            bbox_coords = [int(coord) for coord in query.bbox.split(',')]
+            if len(bbox_coords) != 6:
+                raise ValueError('bbox must have 6 coordinates')
+            bbox = bbox_coords[:3], bbox_coords[3:]
+        else:
+            bbox = None
+        limit = int(query.limit) if query.limit else 1000
+        if limit < 0:
+            raise ValueError('limit must not be negative')
+    except (KeyError, ValueError) as e:
+        bottle.abort(400, 'Invalid search query: {}'.format(e))
+    return api.tile_entities.search(world, dimension=dimension, tile_entity_id=query.id or None, text=query.text or None, item=query.item or None, bbox=bbox, limit=limit)
+
+@application.route('/world/<world>/tiles/<dimension>/<zoom>/<x>/<y>.png')
+@api.util2.decode_args
+def api_tile_png(world: minecraft.World, dimension: api.util2.Dimension, zoom: range(api.tiles.MAX_ZOOM + 1), x: int, y: int):
+    """Returns a top-down render of the dimension as a 512×512px PNG image file, for use with web map libraries. Zoom levels follow the usual web map convention, from 0 (most zoomed out) to 8: on zoom level 8, each tile shows the region with the same coordinates, at one pixel per block. Each tile on a lower zoom level &lt;zoom&gt; is composed of the tiles (2x, 2y) through (2x+1, 2y+1) on zoom level &lt;zoom&gt; + 1. Tiles are re-rendered as needed when the region files change. Requires Pillow and python-anvil."""
+    api.tiles.update_tiles(world, dimension, zoom, x, y)
+    image_path = api.tiles.tile_path(world, dimension, zoom, x, y)
+    if not image_path.exists():
+        bottle.abort(404, 'No chunks have been generated in this area')
+    api.util2.disk_cache_hit(image_path)
+    return bottle.static_file(image_path.name, str(image_path.parent), mimetype='image/png')
 
 @api.util2.nbt_route(application, '/world/<world>/villages/<dimension>')
 @api.util2.decode_args
@@ -727,12 +873,11 @@ def api_villages(world: minecraft.World, dimension: api.util2.Dimension):
         api.util2.Dimension.end: 'villages_end.dat'
     }[dimension]
 
-@api.util2.json_route(application, '/world/<world>/whitelist')
+@api.util2.json_route(application, '/world/<world>/whitelist', sources=lambda world: [world.path / 'whitelist.json'])
 @api.util2.decode_args
 def api_whitelist(world: minecraft.World):
     """Returns the whitelist."""
-    with (world.path / 'whitelist.json').open() as whitelist:
-        return json.load(whitelist)
+    return api.util2.load_json(world.path / 'whitelist.json')
 
 @api.util2.json_route(application, '/server/players')
 def api_player_ids():
@@ -740,7 +885,7 @@ def api_player_ids():
     for player in api.util2.Player.all():
         yield str(player)
 
-@api.util2.json_route(application, '/server/sessions/lastseen')
+@api.util2.json_route(application, '/server/sessions/lastseen', sources=all_log_sources, precompute=lambda: [{}])
 def api_sessions_last_seen_all():
     """Returns the last known session for each player, including the world name."""
     def read_timestamp(timestamp):
@@ -748,7 +893,7 @@ def api_sessions_last_seen_all():
 
     result = {}
     for world in minecraft.worlds():
-        for player_id, timestamp in api_sessions_last_seen_world(world).items():
+        for player_id, timestamp in api_sessions_last_seen_world.shared(world).items():
             if player_id not in result or read_timestamp(timestamp) > read_timestamp(result[player_id]['time']):
                     result[player_id] = {
                         'time': timestamp,
@@ -758,5 +903,39 @@ def api_sessions_last_seen_all():
 
 @api.util2.json_route(application, '/server/worlds')
 def api_worlds():
-    """Returns an object mapping existing world names to short status summaries (like those returned by /world/&lt;world&gt;/status.json but without the lists of online players)"""
-    return {world.name: api.util2.short_world_status(world) for world in minecraft.worlds()}
+    """Returns an object mapping existing world names to short status summaries (like those returned by /world/&lt;world&gt;/status.json but without the lists of online players). The statuses are checked in the background every few seconds; the updated field of each summary is the UTC time of its last check."""
+    result = api.status.world_statuses()
+    for world_status in result.values():
+        world_status.pop('list', None)
+    return result
+
+@api.util2.json_route(application, '/skins/heads/<size>/atlas')
+@api.util2.decode_args
+def api_skin_head_atlas(size: range(1, 257)):
+    """Returns an object mapping player IDs to the pixel offsets ("x" and "y") of their heads in /v2/skins/heads/&lt;size&gt;/atlas.png."""
+    columns, layout = api.util2.head_atlas_layout(size)
+    return {str(player): dict(offset) for player, offset in layout}
+
+@application.route('/skins/heads/<size>/atlas.png')
+@api.util2.decode_args
+def api_skin_head_atlas_png(size: range(1, 257)):
+    """Returns the heads of all known players, each &lt;size&gt;×&lt;size&gt;px, packed into a single PNG image file. The position of each player's head can be found in /v2/skins/heads/&lt;size&gt;/atlas.json. Players whose skin can't be looked up get an empty space. Requires playerhead."""
+    columns, layout = api.util2.head_atlas_layout(size)
+    texture_keys = []
+    for player, offset in layout:
+        try:
+            texture_keys.append(api.util2.skin_texture_key(player))
+        except Exception:
+            texture_keys.append(None) # skin could not be looked up, leave the space empty so the layout still matches atlas.json
+
+    def image_func():
+        import PIL.Image
+
+        rows = max(1, math.ceil(len(layout) / columns))
+        image = PIL.Image.new('RGBA', (columns * size, rows * size), color=(0, 0, 0, 0))
+        for (player, offset), texture_key in zip(layout, texture_keys):
+            if texture_key is not None:
+                image.paste(api.util2.skin_render(player, 'head', texture_key).resize((size, size)), (offset['x'], offset['y']))
+        return image
+
+    return api.util2.cached_image(['skin-head-atlas', size, [[str(player), texture_key] for (player, offset), texture_key in zip(layout, texture_keys)]], image_func)
@@ -0,0 +1,57 @@
+import io
+import json
+import pathlib
+import tempfile
+import unittest
+
+import bottle
+
+try:
+    import api.util2
+except ImportError as e: # the deployment dependencies (minecraft, nbt, wmb, …) are not installed
+    raise unittest.SkipTest('api.util2 is not importable: {}'.format(e))
+
+def get(app, path):
+    environ = {
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'REQUEST_METHOD': 'GET',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.url_scheme': 'http'
+    }
+    status = []
+    body = b''.join(app(environ, lambda status_line, headers, exc_info=None: status.append(status_line)))
+    return status[0], body
+
+class PrecomputedRouteTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = pathlib.Path(self.temp_dir.name) / 'source.txt'
+        self.source.write_text('1')
+        api.util2.set_background_work(False)
+
+    def tearDown(self):
+        api.util2.set_background_work(True)
+        self.temp_dir.cleanup()
+
+    def test_changed_source_without_background_work(self):
+        app = bottle.Bottle()
+
+        @api.util2.json_route(app, '/value', sources=lambda: [self.source], precompute=lambda: [{}])
+        def value():
+            return self.source.read_text()
+
+        api.util2.start_precomputer() # does nothing with background work disabled
+        self.assertFalse(api.util2.precomputer_running())
+        status, body = get(app, '/value.json')
+        self.assertTrue(status.startswith('200'))
+        self.assertEqual(json.loads(body.decode('utf-8')), '1')
+        self.source.write_text('22') # a different size, so the version changes even with coarse modification times
+        status, body = get(app, '/value.json')
+        self.assertTrue(status.startswith('200'))
+        self.assertEqual(json.loads(body.decode('utf-8')), '22')
+
+if __name__ == '__main__':
+    unittest.main()